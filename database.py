@@ -2,6 +2,8 @@
 Настройка базы данных.
 Создает async engine, sessionmaker и Base для SQLAlchemy 2.0.
 """
+from contextlib import asynccontextmanager
+
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
@@ -11,11 +13,32 @@ from sqlalchemy.orm import DeclarativeBase
 
 from config import DATABASE_URL
 
+# asyncpg готовит каждый запрос на сервере (PREPARE) и держит кэш подготовленных
+# выражений на соединение: горячие запросы (is_user_on_level и др.) — module-level
+# statements с bindparam, у них стабильный SQL, поэтому парсинг и планирование
+# выполняются один раз на соединение. Кэш увеличен, чтобы их не вытесняли.
+_connect_args = {}
+# Пул соединений: каждое действие сервиса — 1–2 запроса, установка соединения
+# (TCP + TLS + auth) на каждый запрос стоила бы дороже самих запросов.
+# pool_pre_ping не включён: это лишний round-trip на каждый checkout;
+# оборванные соединения отсекает pool_recycle.
+_pool_args = {}
+if DATABASE_URL.startswith("postgresql+asyncpg"):
+    _connect_args["prepared_statement_cache_size"] = 1024  # по умолчанию 100
+    _pool_args.update(
+        pool_size=20,  # по умолчанию 5
+        max_overflow=10,
+        pool_recycle=1800,  # секунд; раньше серверных/прокси таймаутов простоя
+    )
+
 # Создаем async engine
 engine = create_async_engine(
     DATABASE_URL,
-    echo=False,  # Установить True для отладки SQL запросов
+    echo=False,  # Установить True для отладки SQL запросов ("debug" — видно "[cached since ...]")
     future=True,
+    query_cache_size=1200,  # Кэш скомпилированных запросов (по умолчанию 500)
+    connect_args=_connect_args,
+    **_pool_args,
 )
 
 # Создаем sessionmaker для async сессий
@@ -35,4 +58,45 @@ class Base(DeclarativeBase):
 async def get_db():
     """Генератор сессии для использования в хэндлерах."""
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+# === Unit of work ===
+# Сервисы коммитят каждое действие сами. Внутри unit_of_work их коммиты
+# превращаются во flush, а commit выполняется один раз на выходе из блока.
+
+_UNIT_OF_WORK_KEY = "unit_of_work"
+
+
+async def commit_or_flush(session: AsyncSession) -> None:
+    """Commit — или только flush, если сессия внутри unit_of_work."""
+    if session.info.get(_UNIT_OF_WORK_KEY):
+        await session.flush()
+    else:
+        await session.commit()
+
+
+@asynccontextmanager
+async def unit_of_work(session: AsyncSession):
+    """
+    Одна транзакция на многошаговую операцию (confirm → split, kick → ban).
+
+    Пример (TableService.confirm_payment_and_split):
+        async with unit_of_work(session):
+            await table_service.confirm_payment(table_id, donor_tid)
+            await table_service.split_table(table_id, "left")
+    """
+    if session.info.get(_UNIT_OF_WORK_KEY):
+        # Вложенный блок — коммитит внешний
+        yield session
+        return
+
+    session.info[_UNIT_OF_WORK_KEY] = True
+    try:
+        yield session
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        raise
+    finally:
+        session.info.pop(_UNIT_OF_WORK_KEY, None)
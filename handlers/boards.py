@@ -100,9 +100,12 @@ async def get_user_map(session, table: Table) -> Dict[int, str]:
     ]
     all_tids = [t for t in all_tids if t]
     
+    # Все участники — одним запросом, а не по SELECT на слот
+    users = await user_service.get_by_tids(all_tids)
+    
     user_map = {}
     for tid in all_tids:
-        user = await user_service.get_by_tid(tid)
+        user = users.get(tid)
         if user:
             user_map[tid] = user.display_name
         else:
@@ -184,7 +187,7 @@ async def cmd_boards(message: Message):
         user_tables_by_level = {}  # {level: table}
         
         for table in all_tables:
-            position = await table_service.get_user_position(table, tid)
+            position = table_service.get_user_position(table, tid)
             if position:
                 # Пользователь находится на этой доске
                 level = table.level
@@ -285,7 +288,7 @@ async def cb_view_board(callback: CallbackQuery):
             return
         
         # Получаем позицию пользователя
-        position = await table_service.get_user_position(table, tid)
+        position = table_service.get_user_position(table, tid)
         position_name = get_position_name_ru(position) if position else "Наблюдатель"
         
         # Получаем информацию об уровне
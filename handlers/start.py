@@ -54,7 +54,7 @@ async def cmd_start(message: Message, command: CommandObject) -> None:
             if referrer and referrer.tid != tid:
                 referrer_tid = referrer.tid
                 referrer_name = referrer.display_name
-                logger.info(f"User {tid} пришёл по ссылке от {referrer_tid}")
+                logger.debug("User %s пришёл по ссылке от %s", tid, referrer_tid)
     
     async with AsyncSessionLocal() as session:
         user_service = UserService(session)
@@ -81,7 +81,7 @@ async def cmd_start(message: Message, command: CommandObject) -> None:
             return
         
         if is_new:
-            logger.info(f"Новый пользователь: {tid} ({username})")
+            logger.debug("Новый пользователь: %s (%s)", tid, username)
             
             # Получаем имя наставника для сообщения
             if not referrer_name and referrer_tid:
@@ -98,7 +98,7 @@ async def cmd_start(message: Message, command: CommandObject) -> None:
             # TODO: Показать Disclaimer для подписания
             
         else:
-            logger.info(f"Возврат пользователя: {tid}")
+            logger.debug("Возврат пользователя: %s", tid)
             
             # Получаем наставника
             referrer = await user_service.get_referrer(user)
@@ -1,7 +1,12 @@
 """
 Клавиатуры для пользователя.
 Reply и Inline клавиатуры.
+
+Клавиатуры без параметров собираются один раз при импорте модуля,
+параметрические — кэшируются через lru_cache.
 """
+from functools import lru_cache
+
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
@@ -10,86 +15,96 @@ from aiogram.types import (
 )
 
 
+# Главное меню бота
+_MAIN_MENU_KB = ReplyKeyboardMarkup(
+    keyboard=[
+        [
+            KeyboardButton(text="🫶 О нас"),
+            KeyboardButton(text="📋 Мои доски"),
+        ],
+        [
+            KeyboardButton(text="📄 Инструкции"),
+            KeyboardButton(text="👋 Приглашение"),
+        ],
+        [
+            KeyboardButton(text="🔰 Мой статус"),
+            KeyboardButton(text="🛠️ Инструменты"),
+        ],
+        [
+            KeyboardButton(text="✅ Я тут!"),
+            KeyboardButton(text="💼 Кошелёк"),
+        ],
+    ],
+    resize_keyboard=True,
+)
+
+# Кнопка "Я тут"
+_HEARTBEAT_KB = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="✅ Я тут!")],
+    ],
+    resize_keyboard=True,
+)
+
+# Подтверждение Disclaimer
+_DISCLAIMER_KB = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text="✅ Принимаю правила",
+                callback_data="accept_disclaimer",
+            ),
+        ],
+        [
+            InlineKeyboardButton(
+                text="📖 Прочитать правила",
+                url="https://example.com/rules",
+            ),
+        ],
+    ]
+)
+
+# Подключение кошелька
+_WALLET_CONNECT_KB = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text="💼 Подключить TON Wallet",
+                callback_data="connect_wallet",
+            ),
+        ],
+    ]
+)
+
+
 def get_main_menu_kb() -> ReplyKeyboardMarkup:
     """
     Главное меню бота.
-    
+
     Структура:
     - Левый столбец: 🫶 О нас, 📄 Инструкции, 🔰 Мой статус
     - Правый столбец: 📋 Мои доски, 👋 Приглашение, 🛠️ Инструменты
     - Внизу: ✅ Я тут!, 💼 Кошелёк
     """
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [
-                KeyboardButton(text="🫶 О нас"),
-                KeyboardButton(text="📋 Мои доски"),
-            ],
-            [
-                KeyboardButton(text="📄 Инструкции"),
-                KeyboardButton(text="👋 Приглашение"),
-            ],
-            [
-                KeyboardButton(text="🔰 Мой статус"),
-                KeyboardButton(text="🛠️ Инструменты"),
-            ],
-            [
-                KeyboardButton(text="✅ Я тут!"),
-                KeyboardButton(text="💼 Кошелёк"),
-            ],
-        ],
-        resize_keyboard=True,
-    )
-    return keyboard
+    return _MAIN_MENU_KB
 
 
 def get_heartbeat_kb() -> ReplyKeyboardMarkup:
     """Клавиатура с кнопкой 'Я тут'."""
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="✅ Я тут!")],
-        ],
-        resize_keyboard=True,
-    )
-    return keyboard
+    return _HEARTBEAT_KB
 
 
 def get_disclaimer_kb() -> InlineKeyboardMarkup:
     """Клавиатура для подтверждения Disclaimer."""
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="✅ Принимаю правила",
-                    callback_data="accept_disclaimer",
-                ),
-            ],
-            [
-                InlineKeyboardButton(
-                    text="📖 Прочитать правила",
-                    url="https://example.com/rules",
-                ),
-            ],
-        ]
-    )
-    return keyboard
+    return _DISCLAIMER_KB
 
 
 def get_wallet_connect_kb() -> InlineKeyboardMarkup:
     """Клавиатура для подключения кошелька."""
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="💼 Подключить TON Wallet",
-                    callback_data="connect_wallet",
-                ),
-            ],
-        ]
-    )
-    return keyboard
+    return _WALLET_CONNECT_KB
 
 
+@lru_cache(maxsize=64)
 def get_board_actions_kb(board_id: int) -> InlineKeyboardMarkup:
     """Клавиатура действий на доске."""
     keyboard = InlineKeyboardMarkup(
@@ -117,6 +132,7 @@ def get_board_actions_kb(board_id: int) -> InlineKeyboardMarkup:
     return keyboard
 
 
+@lru_cache(maxsize=64)
 def get_upgrade_kb(level: int) -> InlineKeyboardMarkup:
     """Клавиатура для апгрейда на следующий уровень."""
     keyboard = InlineKeyboardMarkup(
@@ -4,10 +4,22 @@
 import asyncio
 import logging
 
+import orjson
 from aiogram import Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+
+try:
+    import uvloop  # Быстрый event loop (libuv); на Windows недоступен
+except ImportError:
+    uvloop = None
 
 from bot_instance import bot
+from config import INIT_DB
 from database import engine, Base
+from migrations import run_migrations
+from services.board_image_service import get_board_image_service
+from utils.send_message_utils import start_alert_worker, stop_alert_worker
+from utils.time_utils import freeze_now, unfreeze_now
 
 # Импорт роутеров
 from handlers.start import router as start_router
@@ -21,9 +33,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Сессия бота с orjson (быстрее stdlib json при сериализации клавиатур и сообщений)
+bot.session = AiohttpSession(
+    json_loads=orjson.loads,
+    json_dumps=lambda obj: orjson.dumps(obj).decode(),
+)
+
 # Создание диспетчера
 dp = Dispatcher()
 
+
+@dp.update.outer_middleware()
+async def clock_middleware(handler, event, data):
+    """Фиксирует время один раз на апдейт (для свойств моделей)."""
+    token = freeze_now()
+    try:
+        return await handler(event, data)
+    finally:
+        unfreeze_now(token)
+
+
 # Регистрация роутеров
 dp.include_router(start_router)
 dp.include_router(boards_router)
@@ -33,14 +62,26 @@ dp.include_router(admin_router)
 @dp.startup()
 async def on_startup() -> None:
     """Действия при запуске бота."""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    logger.info("✅ База данных подключена, таблицы созданы")
+    start_alert_worker()
+    
+    # Миграции — всегда и до create_all: иначе create_all создаст новые таблицы
+    # пустыми на существующей базе, и миграция не узнает, что их надо заполнить
+    await run_migrations()
+    
+    # Схема создаётся только по флагу: в проде таблицы уже есть
+    if INIT_DB:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        logger.info("✅ База данных подключена, таблицы созданы")
+    
+    # Прогрев: шрифты, шаблон и спрайты грузятся сейчас, а не на первом просмотре доски
+    get_board_image_service()
 
 
 @dp.shutdown()
 async def on_shutdown() -> None:
     """Действия при остановке бота."""
+    await stop_alert_worker()
     await engine.dispose()
     logger.info("👋 Бот остановлен")
 
@@ -51,8 +92,17 @@ async def main() -> None:
     logger.info("🚀 Запуск...")
     
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    await dp.start_polling(
+        bot,
+        polling_timeout=30,
+        # Только те типы апдейтов, которые обрабатывают роутеры
+        allowed_updates=["message", "callback_query"],
+        handle_signals=True,
+    )
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file
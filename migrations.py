@@ -0,0 +1,94 @@
+"""
+Миграции схемы на существующей базе.
+create_all не меняет уже созданные таблицы, поэтому новые таблицы, колонки
+и индексы добавляются здесь. Каждый шаг идемпотентен: проверяет схему и
+применяется только если изменения ещё нет. Производные данные заполняются
+в той же транзакции, что и смена схемы, — до начала обработки апдейтов.
+"""
+import logging
+from typing import List
+
+from sqlalchemy import Column, inspect, text
+
+from database import AsyncSessionLocal, unit_of_work
+from models.table import Table
+from models.table_member import TableMember
+from models.user import User
+from services.table_service import TableService
+
+logger = logging.getLogger(__name__)
+
+
+def _has_column(inspector, table_name: str, column_name: str) -> bool:
+    return any(c["name"] == column_name for c in inspector.get_columns(table_name))
+
+
+def _add_int_column(sync_conn, column: Column) -> None:
+    """
+    ALTER TABLE ... ADD COLUMN для целочисленной колонки-маски.
+    NOT NULL DEFAULT 0 на стороне БД: у модели default только питоновский,
+    а существующим строкам нужно значение.
+    """
+    column_type = column.type.compile(dialect=sync_conn.dialect)
+    sync_conn.execute(text(
+        f"ALTER TABLE {column.table.name} ADD COLUMN {column.name} {column_type} NOT NULL DEFAULT 0"
+    ))
+
+
+def _get_index(table, name: str):
+    return next(index for index in table.indexes if index.name == name)
+
+
+def _apply_schema_changes(sync_conn) -> List[str]:
+    """
+    Применить недостающие изменения схемы.
+
+    Returns:
+        Имена методов TableService для заполнения данных (в порядке вызова)
+    """
+    inspector = inspect(sync_conn)
+    if not inspector.has_table("tables"):
+        # Пустая база: схему целиком создаёт create_all
+        return []
+
+    backfills = []
+
+    # table_members — нормализованная копия слотов досок
+    if not inspector.has_table(TableMember.__tablename__):
+        TableMember.__table__.create(sync_conn)
+        backfills.append("rebuild_members")
+
+    # tables.occupancy_mask и частичный индекс поиска свободных досок по нему
+    if not _has_column(inspector, Table.__tablename__, "occupancy_mask"):
+        _add_int_column(sync_conn, Table.__table__.c.occupancy_mask)
+        backfills.append("rebuild_occupancy")
+    _get_index(Table.__table__, "idx_table_open").create(sync_conn, checkfirst=True)
+
+    # users.active_level_mask — считается по table_members, поэтому после неё
+    if not _has_column(inspector, User.__tablename__, "active_level_mask"):
+        _add_int_column(sync_conn, User.__table__.c.active_level_mask)
+        backfills.append("rebuild_level_masks")
+
+    # users.reflink — код вычисляется из tid (User.reflink), колонка больше не пишется
+    if _has_column(inspector, User.__tablename__, "reflink"):
+        if sync_conn.dialect.name == "postgresql":
+            # Уникальный индекс колонки (users_reflink_key) удаляется вместе с ней
+            sync_conn.execute(text(f"ALTER TABLE {User.__tablename__} DROP COLUMN reflink"))
+        else:
+            # SQLite не удаляет UNIQUE-колонку без пересборки таблицы;
+            # колонка nullable и не используется, на локальной базе её можно оставить
+            logger.warning("Миграция: users.reflink не удалена (только PostgreSQL)")
+
+    return backfills
+
+
+async def run_migrations() -> None:
+    """Привести схему существующей базы к моделям и заполнить новые данные."""
+    async with AsyncSessionLocal() as session:
+        async with unit_of_work(session):
+            conn = await session.connection()
+            backfills = await conn.run_sync(_apply_schema_changes)
+            table_service = TableService(session)
+            for name in backfills:
+                logger.info(f"Миграция: {name}")
+                await getattr(table_service, name)()
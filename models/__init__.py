@@ -2,13 +2,17 @@
 Модели базы данных.
 """
 from .user import User, GLOBAL_ACTIVITY_DURATION, HEARTBEAT_DURATION
-from .table import Table, TableStatus, LEVELS, PAYMENT_TIMEOUT
+from .table import Table, TableStatus, LEVELS, PAYMENT_TIMEOUT, SLOT_NAMES, SLOT_BITS
+from .table_member import TableMember
 
 __all__ = [
     "User",
     "Table",
+    "TableMember",
     "TableStatus",
     "LEVELS",
+    "SLOT_NAMES",
+    "SLOT_BITS",
     "GLOBAL_ACTIVITY_DURATION",
     "HEARTBEAT_DURATION",
     "PAYMENT_TIMEOUT",
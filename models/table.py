@@ -2,14 +2,15 @@
 Модель игровой доски (Table).
 Реализует структуру 15-местной матрицы: REC, CR, ST, D.
 """
-import time
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from enum import Enum
 
-from sqlalchemy import BigInteger, Boolean, Integer, String, Index
+from sqlalchemy import BigInteger, Boolean, Integer, String, Index, and_, case, literal
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import Mapped, mapped_column
 
 from database import Base
+from utils.time_utils import now_ts
 
 
 # === КОНФИГУРАЦИЯ УРОВНЕЙ ===
@@ -29,6 +30,28 @@ LEVELS = {
     13: {"name": "Titan", "amount": 40960},
 }
 
+# Плоские таблицы по индексу уровня (0..13) — без dict.get на каждом чтении
+_LEVEL_NAMES = tuple(LEVELS[i]["name"] if i in LEVELS else "Unknown" for i in range(14))
+_LEVEL_AMOUNTS = tuple(LEVELS[i]["amount"] if i in LEVELS else 0 for i in range(14))
+
+# Порядок 15 позиций на доске (сверху вниз, слева направо)
+SLOT_NAMES = (
+    "rec",
+    "crl", "crr",
+    "stl1", "stl2", "str3", "str4",
+    "dl1", "dl2", "dl3", "dl4",
+    "dr5", "dr6", "dr7", "dr8",
+)
+
+# Битовые маски дарителей: биты 0-3 — DL1..DL4, биты 4-7 — DR5..DR8
+LEFT_DONORS_MASK = 0x0F
+RIGHT_DONORS_MASK = 0xF0
+
+# Маска занятости всех 15 позиций (колонка occupancy_mask): бит i — SLOT_NAMES[i]
+SLOT_BITS = {name: 1 << i for i, name in enumerate(SLOT_NAMES)}
+FULL_OCCUPANCY_MASK = (1 << len(SLOT_NAMES)) - 1
+DONOR_OCCUPANCY_MASK = sum(SLOT_BITS[name] for name in SLOT_NAMES[7:])
+
 # Таймеры (секунды)
 PAYMENT_TIMEOUT = 72 * 60 * 60  # 72 часа на оплату
 CONFIRM_TIMEOUT = 24 * 60 * 60  # 24 часа на подтверждение (авто)
@@ -54,6 +77,8 @@ class Table(Base):
         Index("idx_table_active", "isactive"),
         {"extend_existing": True}
     )
+    # PK и значения по умолчанию приходят из INSERT ... RETURNING — refresh после commit не нужен
+    __mapper_args__ = {"eager_defaults": True}
 
     # === ИДЕНТИФИКАЦИЯ ===
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
@@ -68,7 +93,7 @@ class Table(Base):
     split_side: Mapped[Optional[str]] = mapped_column(String(8), nullable=True)
     
     # === ВРЕМЕННЫЕ МЕТКИ ===
-    created_at: Mapped[int] = mapped_column(BigInteger, default=lambda: int(time.time()))
+    created_at: Mapped[int] = mapped_column(BigInteger, default=now_ts)
     closed_at: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
     
     # === СТАТУСЫ ===
@@ -77,6 +102,9 @@ class Table(Base):
     
     # Счётчик полученных подарков (1-8)
     gifts_received: Mapped[int] = mapped_column(Integer, default=0)
+    
+    # Занятость позиций (бит на слот, см. SLOT_BITS) — для фильтрации на стороне БД
+    occupancy_mask: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
 
     # === 15 ПОЗИЦИЙ (tid пользователей, без ForeignKey) ===
     
@@ -131,12 +159,14 @@ class Table(Base):
     @property
     def level_name(self) -> str:
         """Название уровня."""
-        return LEVELS.get(self.level, {}).get("name", "Unknown")
+        level = self.level
+        return _LEVEL_NAMES[level] if level is not None and 0 <= level < 14 else "Unknown"
     
     @property
     def gift_amount(self) -> int:
         """Сумма подарка на этом уровне (USDT)."""
-        return LEVELS.get(self.level, {}).get("amount", 0)
+        level = self.level
+        return _LEVEL_AMOUNTS[level] if level is not None and 0 <= level < 14 else 0
 
     # === PROPERTIES: Состояние доски ===
 
@@ -165,55 +195,136 @@ class Table(Base):
         """Статусы оплаты справа."""
         return [self.dr5_pay, self.dr6_pay, self.dr7_pay, self.dr8_pay]
 
+    @property
+    def _donor_mask(self) -> int:
+        """Битовая маска занятых мест дарителей."""
+        return (
+            (self.dl1 is not None)
+            | (self.dl2 is not None) << 1
+            | (self.dl3 is not None) << 2
+            | (self.dl4 is not None) << 3
+            | (self.dr5 is not None) << 4
+            | (self.dr6 is not None) << 5
+            | (self.dr7 is not None) << 6
+            | (self.dr8 is not None) << 7
+        )
+
+    @hybrid_property
+    def pay_mask(self) -> int:
+        """Битовая маска оплаченных мест дарителей (бит 0 — dl1, ..., бит 7 — dr8)."""
+        return (
+            bool(self.dl1_pay)
+            | bool(self.dl2_pay) << 1
+            | bool(self.dl3_pay) << 2
+            | bool(self.dl4_pay) << 3
+            | bool(self.dr5_pay) << 4
+            | bool(self.dr6_pay) << 5
+            | bool(self.dr7_pay) << 6
+            | bool(self.dr8_pay) << 7
+        )
+
+    @pay_mask.inplace.expression
+    @classmethod
+    def _pay_mask_expression(cls):
+        """SQL: та же маска из колонок *_pay."""
+        terms = [
+            case((getattr(cls, f"{slot}_pay") == True, 1 << bit), else_=0)
+            for bit, slot in enumerate(SLOT_NAMES[7:])
+        ]
+        return sum(terms[1:], terms[0])
+
     @property
     def is_left_full(self) -> bool:
         """Все места слева заняты."""
-        return all(tid is not None for tid in self.left_donors)
+        return self._donor_mask & LEFT_DONORS_MASK == LEFT_DONORS_MASK
 
     @property
     def is_right_full(self) -> bool:
         """Все места справа заняты."""
-        return all(tid is not None for tid in self.right_donors)
+        return self._donor_mask & RIGHT_DONORS_MASK == RIGHT_DONORS_MASK
     
     @property
     def is_left_paid(self) -> bool:
         """Все 4 дарителя слева оплатили."""
-        return all(self.left_payments)
+        return self.pay_mask & LEFT_DONORS_MASK == LEFT_DONORS_MASK
 
     @property
     def is_right_paid(self) -> bool:
         """Все 4 дарителя справа оплатили."""
-        return all(self.right_payments)
+        return self.pay_mask & RIGHT_DONORS_MASK == RIGHT_DONORS_MASK
 
     @property
     def can_split_left(self) -> bool:
         """Можно разделить левую сторону."""
-        return self.is_left_full and self.is_left_paid
+        return (self._donor_mask & self.pay_mask & LEFT_DONORS_MASK) == LEFT_DONORS_MASK
 
     @property
     def can_split_right(self) -> bool:
         """Можно разделить правую сторону."""
-        return self.is_right_full and self.is_right_paid
+        return (self._donor_mask & self.pay_mask & RIGHT_DONORS_MASK) == RIGHT_DONORS_MASK
 
     @property
     def empty_slots_left(self) -> int:
         """Количество свободных мест слева."""
-        return sum(1 for tid in self.left_donors if tid is None)
+        return 4 - (self._donor_mask & LEFT_DONORS_MASK).bit_count()
 
     @property
     def empty_slots_right(self) -> int:
         """Количество свободных мест справа."""
-        return sum(1 for tid in self.right_donors if tid is None)
+        return 4 - (self._donor_mask & RIGHT_DONORS_MASK).bit_count()
     
     @property
     def empty_slots_total(self) -> int:
         """Всего свободных мест для дарителей."""
-        return self.empty_slots_left + self.empty_slots_right
+        return 8 - self._donor_mask.bit_count()
 
     @property
     def paid_count(self) -> int:
         """Количество оплаченных подарков."""
-        return sum(self.left_payments) + sum(self.right_payments)
+        return self.pay_mask.bit_count()
+
+    # === METHODS: Снимок позиций ===
+
+    @property
+    def slot_tids(self) -> Tuple[Optional[int], ...]:
+        """tid всех 15 позиций (порядок как в SLOT_NAMES)."""
+        return (
+            self.rec,
+            self.crl, self.crr,
+            self.stl1, self.stl2, self.str3, self.str4,
+            self.dl1, self.dl2, self.dl3, self.dl4,
+            self.dr5, self.dr6, self.dr7, self.dr8,
+        )
+
+    def snapshot(
+        self,
+    ) -> Tuple[
+        Tuple[Optional[int], ...],
+        Tuple[Optional[bool], ...],
+        Tuple[Optional[int], ...],
+    ]:
+        """
+        Снимок всех 15 позиций за один проход (порядок как в SLOT_NAMES).
+
+        Returns:
+            Tuple[tids, pays, deadlines] — для REC/CR/ST оплата и дедлайн None
+        """
+        tids = self.slot_tids
+        pays = (
+            None,
+            None, None,
+            None, None, None, None,
+            self.dl1_pay, self.dl2_pay, self.dl3_pay, self.dl4_pay,
+            self.dr5_pay, self.dr6_pay, self.dr7_pay, self.dr8_pay,
+        )
+        deadlines = (
+            None,
+            None, None,
+            None, None, None, None,
+            self.dl1_deadline, self.dl2_deadline, self.dl3_deadline, self.dl4_deadline,
+            self.dr5_deadline, self.dr6_deadline, self.dr7_deadline, self.dr8_deadline,
+        )
+        return tids, pays, deadlines
 
     # === METHODS: Поиск свободного места ===
     
@@ -260,4 +371,29 @@ class Table(Base):
         deadline = self.get_slot_deadline(slot_name)
         if deadline is None:
             return False
-        return int(time.time()) > deadline
+        return now_ts() > deadline
+
+
+# Открытая доска со свободным местом дарителя. Константы встроены литералами (не bind-параметрами):
+# WHERE запроса должен дословно совпадать с условием частичного индекса idx_table_open,
+# иначе планировщик не сможет им воспользоваться.
+OPEN_TABLE_CONDITION = and_(
+    Table.isactive == True,
+    Table.status.in_([
+        literal(TableStatus.WAITING.value, literal_execute=True),
+        literal(TableStatus.ACTIVE.value, literal_execute=True),
+    ]),
+    Table.occupancy_mask.op("&")(literal(DONOR_OCCUPANCY_MASK, literal_execute=True))
+    != literal(DONOR_OCCUPANCY_MASK, literal_execute=True),
+)
+
+# Частичный индекс под глобальный перелив (TableService._find_any_open_table):
+# порядок совпадает с ORDER BY — range scan с LIMIT 1 вместо seq scan + сортировки
+Index(
+    "idx_table_open",
+    Table.level,
+    Table.gifts_received.desc(),
+    Table.created_at.asc(),
+    postgresql_where=OPEN_TABLE_CONDITION,
+    sqlite_where=OPEN_TABLE_CONDITION,
+)
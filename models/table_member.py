@@ -0,0 +1,42 @@
+"""
+Модель участия в доске (TableMember).
+Нормализованная копия 15 позиций доски: одна строка = один tid на одном слоте.
+Позволяет проверять "уже на уровне?" одним индексным поиском
+вместо OR по 15 колонкам tables.
+"""
+from sqlalchemy import BigInteger, Boolean, Integer, String, Index
+from sqlalchemy.orm import Mapped, mapped_column
+
+from database import Base
+
+
+class TableMember(Base):
+    """
+    Участник доски.
+    Поддерживается в тех же транзакциях, что и слоты Table (TableService).
+    """
+
+    __tablename__ = "table_members"
+    __table_args__ = (
+        Index("idx_member_tid_level_active", "tid", "level", "isactive"),
+        Index("idx_member_table_slot", "table_id", "slot"),
+        {"extend_existing": True}
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+
+    # Доска (без ForeignKey — связь через код, как и у слотов)
+    table_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+    # Уровень доски (денормализован для индекса)
+    level: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    # tid пользователя и его слот (rec, crl, ..., dr8)
+    tid: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    slot: Mapped[str] = mapped_column(String(8), nullable=False)
+
+    # Доска активна (копия Table.isactive)
+    isactive: Mapped[bool] = mapped_column(Boolean, default=True)
+
+    def __repr__(self) -> str:
+        return f"<TableMember table={self.table_id} slot={self.slot} tid={self.tid}>"
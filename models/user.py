@@ -2,13 +2,14 @@
 Модель пользователя.
 Хранит данные пользователей Telegram и реферальную информацию.
 """
-import time
 from typing import Optional
 
-from sqlalchemy import BigInteger, Boolean, Integer, String, Index
+from sqlalchemy import BigInteger, Boolean, Integer, String, Index, cast, literal
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import Mapped, mapped_column
 
 from database import Base
+from utils.time_utils import now_ts
 
 # Константы времени (в секундах)
 GLOBAL_ACTIVITY_DURATION = 30 * 24 * 60 * 60  # 30 дней
@@ -17,6 +18,9 @@ BAN_DURATION_FIRST = 72 * 60 * 60  # 72 часа (1-е нарушение)
 BAN_DURATION_SECOND = 144 * 60 * 60  # 144 часа (2-е нарушение)
 BAN_DURATION_THIRD = 288 * 60 * 60  # 288 часов (3+ нарушение)
 
+# Реферальный код = префикс + tid (вычисляется, в БД не хранится)
+REFLINK_PREFIX = "dp_"
+
 
 class User(Base):
     """Модель пользователя системы."""
@@ -37,7 +41,6 @@ class User(Base):
     
     # Реферальная система (без ForeignKey — связь через код)
     isref: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True, index=True)
-    reflink: Mapped[Optional[str]] = mapped_column(String(64), unique=True, nullable=True)
     refscount: Mapped[int] = mapped_column(Integer, default=0)
     
     # Время регистрации (Unix timestamp)
@@ -57,12 +60,31 @@ class User(Base):
     
     # Текущая активность "Я тут" (48 часов)
     heartbeat_until: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    
+    # Уровни, на которых пользователь сидит на открытой доске (бит N — уровень N).
+    # Поддерживается TableService вместе со слотами досок.
+    active_level_mask: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
 
     def __repr__(self) -> str:
         return f"<User tid={self.tid} username={self.username}>"
 
     # === Properties ===
 
+    @hybrid_property
+    def reflink(self) -> str:
+        """Реферальный код пользователя."""
+        return f"{REFLINK_PREFIX}{self.tid}"
+
+    @reflink.inplace.expression
+    @classmethod
+    def _reflink_expression(cls):
+        """SQL: тот же код из tid."""
+        return literal(REFLINK_PREFIX) + cast(cls.tid, String)
+
+    def is_on_level(self, level: int) -> bool:
+        """Сидит ли пользователь на открытой доске уровня level."""
+        return bool((self.active_level_mask or 0) >> level & 1)
+
     @property
     def display_name(self) -> str:
         """Отображаемое имя пользователя."""
@@ -82,14 +104,14 @@ class User(Base):
         """Проверка глобальной активности (30 дней)."""
         if not self.global_activity_until:
             return False
-        return int(time.time()) < self.global_activity_until
+        return now_ts() < self.global_activity_until
 
     @property
     def is_heartbeat_active(self) -> bool:
         """Проверка текущей активности (48ч)."""
         if not self.heartbeat_until:
             return False
-        return int(time.time()) < self.heartbeat_until
+        return now_ts() < self.heartbeat_until
 
     @property
     def is_dormant(self) -> bool:
@@ -101,7 +123,7 @@ class User(Base):
         """Проверка временной блокировки."""
         if not self.ban_until:
             return False
-        return int(time.time()) < self.ban_until
+        return now_ts() < self.ban_until
 
     @property
     def can_participate(self) -> bool:
@@ -113,7 +135,7 @@ class User(Base):
         """Часов до разблокировки."""
         if not self.ban_until:
             return 0
-        remaining = self.ban_until - int(time.time())
+        remaining = self.ban_until - now_ts()
         return max(0, remaining // 3600)
 
     @property
@@ -121,7 +143,7 @@ class User(Base):
         """Дней глобальной активности."""
         if not self.global_activity_until:
             return 0
-        remaining = self.global_activity_until - int(time.time())
+        remaining = self.global_activity_until - now_ts()
         return max(0, remaining // 86400)
 
     @property
@@ -129,5 +151,5 @@ class User(Base):
         """Часов текущей активности."""
         if not self.heartbeat_until:
             return 0
-        remaining = self.heartbeat_until - int(time.time())
+        remaining = self.heartbeat_until - now_ts()
         return max(0, remaining // 3600)
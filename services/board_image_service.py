@@ -2,13 +2,17 @@
 Сервис генерации изображений досок.
 Создаёт картинку с логинами участников на их позициях.
 """
+import asyncio
+import functools
 import os
+import threading
+import time
 from io import BytesIO
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 
 from PIL import Image, ImageDraw, ImageFont
 
-from models.table import Table, LEVELS
+from models.table import Table, LEVELS, SLOT_NAMES
 
 
 # Путь к шаблону доски
@@ -46,6 +50,16 @@ POSITIONS = {
     'dr8': (720, 500),
 }
 
+# Кэш общего рендера доски (секунды / число записей)
+RENDER_CACHE_TTL = 30
+RENDER_CACHE_MAX_SIZE = 256
+# Максимум закэшированных масок подписей
+TEXT_MASK_CACHE_MAX_SIZE = 1024
+
+# Размер подложки слота (полуширина/полувысота)
+PILL_HALF_WIDTH = 45
+PILL_HALF_HEIGHT = 15
+
 # Цвета
 COLORS = {
     'rec': (255, 215, 0),      # Золотой - получатель
@@ -59,6 +73,24 @@ COLORS = {
 }
 
 
+def _role_color(slot_name: str) -> Optional[tuple]:
+    """Цвет роли слота (None для дарителей — зависит от оплаты)."""
+    if slot_name == 'rec':
+        return COLORS['rec']
+    if slot_name.startswith('cr'):
+        return COLORS['creator']
+    if slot_name.startswith('st'):
+        return COLORS['builder']
+    return None
+
+
+# Раскладка слотов в порядке SLOT_NAMES: (имя, координаты, цвет роли)
+SLOT_TABLE = tuple(
+    (slot_name, POSITIONS[slot_name], _role_color(slot_name))
+    for slot_name in SLOT_NAMES
+)
+
+
 class BoardImageService:
     """Сервис генерации изображений досок."""
     
@@ -66,6 +98,42 @@ class BoardImageService:
         self.template_path = TEMPLATE_PATH
         self.font_path = FONT_PATH
         self.positions = POSITIONS
+        
+        # Шрифты загружаются один раз (парсинг TTF — дорогая операция)
+        try:
+            self.font = ImageFont.truetype(self.font_path, 20)
+            self.font_small = ImageFont.truetype(self.font_path, 16)
+            self.font_title = ImageFont.truetype(self.font_path, 28)
+        except OSError:
+            # Используем встроенный шрифт
+            self.font = ImageFont.load_default()
+            self.font_small = self.font
+            self.font_title = self.font
+        
+        # Шаблон не зависит от доски — декодируем/рисуем один раз, на рендер делаем .copy()
+        if os.path.exists(self.template_path):
+            self._template = Image.open(self.template_path).convert('RGBA')
+        else:
+            # Создаём простой шаблон если файла нет
+            self._template = self._create_default_template()
+        
+        # Легенда статична — рисуем её прямо в кэшированный шаблон
+        self._draw_legend(ImageDraw.Draw(self._template), self._template, self.font_small)
+        
+        # Подложки слотов: геометрия одна, меняется только цвет — готовим спрайты заранее
+        self._pill_mask = self._create_pill_mask()
+        self._pills = {color: self._create_pill(color) for color in COLORS.values()}
+        
+        # {ключ состояния доски: (время, изображение, PNG)}
+        self._render_cache: Dict[tuple, Tuple[float, Image.Image, bytes]] = {}
+        
+        # {(текст, шрифт): маска глифов} — подписи повторяются между рендерами
+        self._text_masks: Dict[tuple, Tuple[Image.Image, int, int]] = {}
+        
+        # Рендер идёт в потоках (asyncio.to_thread): чтение, чистка и запись кэшей — под локами.
+        # Сама отрисовка выполняется вне лока.
+        self._render_cache_lock = threading.Lock()
+        self._text_masks_lock = threading.Lock()
     
     async def generate_board_image(
         self,
@@ -86,75 +154,84 @@ class BoardImageService:
         Returns:
             BytesIO с изображением PNG
         """
+        # Рендер PIL — чистый CPU, уводим его с event loop в пул потоков
+        return await asyncio.to_thread(
+            self._render_board_image,
+            table,
+            user_map,
+            current_user_tid,
+            referral_tids,
+        )
+    
+    def _render_board_image(
+        self,
+        table: Table,
+        user_map: Dict[int, str],
+        current_user_tid: Optional[int] = None,
+        referral_tids: Optional[list] = None,
+    ) -> BytesIO:
+        """
+        Синхронный рендер изображения доски (выполняется в отдельном потоке).
+        
+        Общая часть (шаблон, заголовок, все слоты без подсветки) рендерится один раз
+        на состояние доски и кэшируется на RENDER_CACHE_TTL секунд. Для каждого зрителя
+        поверх копии перерисовываются только его слот и слоты его рефералов.
+        """
         referral_tids = referral_tids or []
         
-        # Загружаем шаблон или создаём пустой
-        if os.path.exists(self.template_path):
-            img = Image.open(self.template_path).convert('RGBA')
-        else:
-            # Создаём простой шаблон если файла нет
-            img = self._create_default_template(table)
+        tids, pays, _ = table.snapshot()
+        names = tuple(user_map.get(tid) if tid else None for tid in tids)
+        key = (table.id, table.level, table.gifts_received, tids, pays, names)
         
+        base_img, base_png = self._get_base_render(key, table, user_map, tids, pays)
+        
+        # Слоты с персональной подсветкой
+        personal = [
+            (pos, tid)
+            for (_, pos, _), tid in zip(SLOT_TABLE, tids)
+            if tid and (tid == current_user_tid or tid in referral_tids)
+        ]
+        if not personal:
+            return BytesIO(base_png)
+        
+        img = base_img.copy()
         draw = ImageDraw.Draw(img)
+        for pos, tid in personal:
+            color = COLORS['highlight'] if tid == current_user_tid else COLORS['referral']
+            self._draw_slot(img, draw, pos, self._slot_label(tid, user_map), color)
         
-        # Загружаем шрифт
-        try:
-            font = ImageFont.truetype(self.font_path, 20)
-            font_small = ImageFont.truetype(self.font_path, 16)
-            font_title = ImageFont.truetype(self.font_path, 28)
-        except:
-            # Используем встроенный шрифт
-            font = ImageFont.load_default()
-            font_small = font
-            font_title = font
+        return self._encode_png(img)
+    
+    def _get_base_render(
+        self,
+        key: tuple,
+        table: Table,
+        user_map: Dict[int, str],
+        tids: tuple,
+        pays: tuple,
+    ) -> Tuple[Image.Image, bytes]:
+        """Получить общий рендер доски из кэша или отрисовать заново."""
+        now = time.monotonic()
+        with self._render_cache_lock:
+            cached = self._render_cache.get(key)
+        if cached and now - cached[0] < RENDER_CACHE_TTL:
+            return cached[1], cached[2]
+        
+        img = self._template.copy()
+        draw = ImageDraw.Draw(img)
         
         # Рисуем заголовок
         level_info = LEVELS.get(table.level, {})
         title = f"{level_info.get('name', 'Доска')} (#{table.id})"
-        self._draw_centered_text(draw, title, (img.width // 2, 50), font_title, (255, 255, 255))
+        self._draw_centered_text(draw, title, (img.width // 2, 50), self.font_title, (255, 255, 255))
         
-        # Рисуем участников
-        slots = {
-            'rec': (table.rec, None),
-            'crl': (table.crl, None),
-            'crr': (table.crr, None),
-            'stl1': (table.stl1, None),
-            'stl2': (table.stl2, None),
-            'str3': (table.str3, None),
-            'str4': (table.str4, None),
-            'dl1': (table.dl1, table.dl1_pay),
-            'dl2': (table.dl2, table.dl2_pay),
-            'dl3': (table.dl3, table.dl3_pay),
-            'dl4': (table.dl4, table.dl4_pay),
-            'dr5': (table.dr5, table.dr5_pay),
-            'dr6': (table.dr6, table.dr6_pay),
-            'dr7': (table.dr7, table.dr7_pay),
-            'dr8': (table.dr8, table.dr8_pay),
-        }
-        
-        for slot_name, (tid, is_paid) in slots.items():
-            pos = self.positions.get(slot_name)
-            if not pos:
-                continue
-            
+        # Рисуем участников (без персональной подсветки)
+        for (slot_name, pos, role_color), tid, is_paid in zip(SLOT_TABLE, tids, pays):
             # Определяем текст и цвет
             if tid:
-                name = user_map.get(tid, f"ID:{tid}")
-                # Укорачиваем длинные имена
-                if len(name) > 12:
-                    name = name[:10] + ".."
-                
-                # Определяем цвет
-                if tid == current_user_tid:
-                    color = COLORS['highlight']  # Красный - это вы
-                elif tid in referral_tids:
-                    color = COLORS['referral']   # Синий - ваш реферал
-                elif slot_name == 'rec':
-                    color = COLORS['rec']
-                elif slot_name.startswith('cr'):
-                    color = COLORS['creator']
-                elif slot_name.startswith('st'):
-                    color = COLORS['builder']
+                name = self._slot_label(tid, user_map)
+                if role_color:
+                    color = role_color
                 elif is_paid:
                     color = COLORS['donor_paid']
                 else:
@@ -163,23 +240,48 @@ class BoardImageService:
                 name = "Свободно"
                 color = COLORS['empty']
             
-            # Рисуем подложку
-            self._draw_slot_background(draw, pos, color)
-            
-            # Рисуем текст
-            self._draw_centered_text(draw, name, pos, font_small, (255, 255, 255))
+            self._draw_slot(img, draw, pos, name, color)
+        
+        png = self._encode_png(img).getvalue()
         
-        # Рисуем легенду
-        self._draw_legend(draw, img, font_small)
+        # Чистим протухшие записи, чтобы кэш не рос бесконечно
+        with self._render_cache_lock:
+            if len(self._render_cache) >= RENDER_CACHE_MAX_SIZE:
+                for stale_key in [k for k, v in self._render_cache.items() if now - v[0] >= RENDER_CACHE_TTL]:
+                    self._render_cache.pop(stale_key, None)
+                if len(self._render_cache) >= RENDER_CACHE_MAX_SIZE:
+                    self._render_cache.clear()
+            self._render_cache[key] = (now, img, png)
         
-        # Сохраняем в BytesIO
+        return img, png
+    
+    def _slot_label(self, tid: int, user_map: Dict[int, str]) -> str:
+        """Подпись слота (длинные имена укорачиваются)."""
+        name = user_map.get(tid, f"ID:{tid}")
+        if len(name) > 12:
+            name = name[:10] + ".."
+        return name
+    
+    def _draw_slot(
+        self,
+        img: Image.Image,
+        draw: ImageDraw,
+        pos: tuple,
+        name: str,
+        color: tuple,
+    ):
+        """Рисует подложку и подпись слота."""
+        self._paste_slot_background(img, pos, color)
+        self._draw_centered_text(draw, name, pos, self.font_small, (255, 255, 255))
+    
+    def _encode_png(self, img: Image.Image) -> BytesIO:
+        """Сохраняет в BytesIO (быстрое сжатие: картинка одноразовая, Telegram пережмёт её сам)."""
         output = BytesIO()
-        img.save(output, format='PNG')
+        img.save(output, format='PNG', compress_level=1, optimize=False)
         output.seek(0)
-        
         return output
     
-    def _create_default_template(self, table: Table) -> Image.Image:
+    def _create_default_template(self) -> Image.Image:
         """Создаёт простой шаблон доски."""
         width, height = 800, 650
         img = Image.new('RGBA', (width, height), (30, 40, 50, 255))
@@ -208,17 +310,37 @@ class BoardImageService:
         
         return img
     
-    def _draw_slot_background(self, draw: ImageDraw, pos: tuple, color: tuple):
-        """Рисует фон для слота."""
-        x, y = pos
-        padding = 45
-        draw.rounded_rectangle(
-            [(x - padding, y - 15), (x + padding, y + 15)],
+    def _create_pill(self, color: tuple) -> Image.Image:
+        """Создаёт спрайт подложки слота заданного цвета."""
+        pill = Image.new('RGBA', (2 * PILL_HALF_WIDTH + 1, 2 * PILL_HALF_HEIGHT + 1), (0, 0, 0, 0))
+        ImageDraw.Draw(pill).rounded_rectangle(
+            [(0, 0), (2 * PILL_HALF_WIDTH, 2 * PILL_HALF_HEIGHT)],
             radius=8,
             fill=(*color, 200),
             outline=(255, 255, 255, 100),
             width=1
         )
+        return pill
+    
+    def _create_pill_mask(self) -> Image.Image:
+        """Маска формы подложки (пиксели внутри скруглённого прямоугольника)."""
+        mask = Image.new('L', (2 * PILL_HALF_WIDTH + 1, 2 * PILL_HALF_HEIGHT + 1), 0)
+        ImageDraw.Draw(mask).rounded_rectangle(
+            [(0, 0), (2 * PILL_HALF_WIDTH, 2 * PILL_HALF_HEIGHT)],
+            radius=8,
+            fill=255,
+            outline=255,
+            width=1
+        )
+        return mask
+    
+    def _paste_slot_background(self, img: Image.Image, pos: tuple, color: tuple):
+        """Накладывает готовую подложку слота."""
+        pill = self._pills.get(color)
+        if pill is None:
+            pill = self._pills[color] = self._create_pill(color)
+        x, y = pos
+        img.paste(pill, (x - PILL_HALF_WIDTH, y - PILL_HALF_HEIGHT), self._pill_mask)
     
     def _draw_centered_text(
         self,
@@ -228,18 +350,30 @@ class BoardImageService:
         font: ImageFont,
         color: tuple
     ):
-        """Рисует текст по центру позиции."""
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        
-        x = pos[0] - text_width // 2
-        y = pos[1] - text_height // 2
+        """Рисует текст по центру позиции (маска глифов растеризуется один раз на текст)."""
+        mask, left, top = self._text_mask(text, font)
+        x, y = pos
         
         # Тень
-        draw.text((x + 1, y + 1), text, font=font, fill=(0, 0, 0, 128))
+        draw.bitmap((x + 1 + left, y + 1 + top), mask, fill=(0, 0, 0, 128))
         # Основной текст
-        draw.text((x, y), text, font=font, fill=color)
+        draw.bitmap((x + left, y + top), mask, fill=color)
+    
+    def _text_mask(self, text: str, font: ImageFont) -> Tuple[Image.Image, int, int]:
+        """Маска текста с якорем по центру: (маска, смещение x, смещение y)."""
+        key = (text, id(font))
+        with self._text_masks_lock:
+            cached = self._text_masks.get(key)
+        if cached is None:
+            left, top, right, bottom = font.getbbox(text, anchor='mm')
+            mask = Image.new('L', (right - left, bottom - top), 0)
+            ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255, anchor='mm')
+            cached = (mask, left, top)
+            with self._text_masks_lock:
+                if len(self._text_masks) >= TEXT_MASK_CACHE_MAX_SIZE:
+                    self._text_masks.clear()
+                self._text_masks[key] = cached
+        return cached
     
     def _draw_legend(self, draw: ImageDraw, img: Image.Image, font: ImageFont):
         """Рисует легенду."""
@@ -262,12 +396,8 @@ class BoardImageService:
             x_offset += 150
 
 
-# Singleton
-_board_image_service = None
-
+# Singleton (создаётся при первом вызове; main прогревает его на старте)
+@functools.cache
 def get_board_image_service() -> BoardImageService:
     """Получить сервис генерации изображений."""
-    global _board_image_service
-    if _board_image_service is None:
-        _board_image_service = BoardImageService()
-    return _board_image_service
+    return BoardImageService()
@@ -2,18 +2,277 @@
 Сервис управления досками (Tables).
 Объединяет лучшие практики: полная функциональность + умные алгоритмы.
 """
-import time
-from typing import Optional, List, Tuple
+from typing import Optional, Dict, List, Mapping, Tuple
 from enum import Enum
+from functools import lru_cache
+from types import MappingProxyType
 
-from sqlalchemy import select, update, and_, or_, func
+from sqlalchemy import (
+    BigInteger,
+    select,
+    update,
+    delete,
+    insert,
+    union_all,
+    literal,
+    and_,
+    or_,
+    case,
+    func,
+    bindparam,
+)
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import raiseload
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.attributes import set_committed_value
 
-from models.table import Table, TableStatus, LEVELS, PAYMENT_TIMEOUT
+from database import commit_or_flush, unit_of_work
+from models.table import (
+    Table,
+    TableStatus,
+    LEVELS,
+    PAYMENT_TIMEOUT,
+    SLOT_NAMES,
+    SLOT_BITS,
+    FULL_OCCUPANCY_MASK,
+    OPEN_TABLE_CONDITION,
+)
+from models.table_member import TableMember
 from models.user import User
-from services.user_service import UserService
-from utils.send_message_utils import alert
+from services.user_service import UserService, mark_user_changed, mark_all_users_changed
+from utils.send_message_utils import alert_nowait
+from utils.time_utils import now_ts
+
+
+# Статусы "открытой" доски
+OPEN_STATUSES = (TableStatus.WAITING.value, TableStatus.ACTIVE.value)
+
+# Готовые запросы (собираются один раз — ключ кэша компиляции стабилен,
+# SQL компилируется один раз и дальше берётся из query cache движка)
+# Ленивые загрузки связей запрещены: случайный N+1 падает сразу, а не тормозит молча.
+# Если связь понадобится — явно selectinload в конкретном запросе.
+_TABLE_LOAD_OPTIONS = (raiseload("*"),)
+
+_RECEIVER_TABLE_QUERY = select(Table).options(*_TABLE_LOAD_OPTIONS).where(
+    and_(
+        Table.rec == bindparam("receiver_tid"),
+        Table.level == bindparam("level"),
+        Table.isactive == True,
+        Table.status.in_(OPEN_STATUSES),
+    )
+)
+
+# Доски всех наставников цепочки одним запросом (IN вместо запроса на каждого)
+_RECEIVER_TABLES_BATCH_QUERY = select(Table).options(*_TABLE_LOAD_OPTIONS).where(
+    and_(
+        Table.rec.in_(bindparam("receiver_tids", expanding=True)),
+        Table.level == bindparam("level"),
+        Table.isactive == True,
+        Table.status.in_(OPEN_STATUSES),
+    )
+)
+
+_ANY_OPEN_TABLE_QUERY = (
+    select(Table)
+    .options(*_TABLE_LOAD_OPTIONS)
+    .where(
+        and_(
+            Table.level == bindparam("level"),
+            # Открыта и есть свободное место дарителя (= условие частичного индекса)
+            OPEN_TABLE_CONDITION,
+        )
+    )
+    .order_by(
+        Table.gifts_received.desc(),  # Приоритет заполненным
+        Table.created_at.asc(),       # Потом по старшинству
+    )
+    .limit(1)
+)
+
+
+# Слоты дарителей
+LEFT_DONOR_SLOTS = ('dl1', 'dl2', 'dl3', 'dl4')
+RIGHT_DONOR_SLOTS = ('dr5', 'dr6', 'dr7', 'dr8')
+DONOR_SLOTS = LEFT_DONOR_SLOTS + RIGHT_DONOR_SLOTS
+
+# Слоты, уходящие на новую доску при разделении
+SPLIT_SLOTS = {
+    "left": ('crl', 'stl1', 'stl2') + LEFT_DONOR_SLOTS,
+    "right": ('crr', 'str3', 'str4') + RIGHT_DONOR_SLOTS,
+}
+
+# Значения для очистки отделившейся стороны родительской доски
+_LEFT_CLEAR = MappingProxyType({
+    **{slot: None for slot in SPLIT_SLOTS["left"]},
+    **{f"{slot}_pay": False for slot in LEFT_DONOR_SLOTS},
+    **{f"{slot}_deadline": None for slot in LEFT_DONOR_SLOTS},
+})
+_RIGHT_CLEAR = MappingProxyType({
+    **{slot: None for slot in SPLIT_SLOTS["right"]},
+    **{f"{slot}_pay": False for slot in RIGHT_DONOR_SLOTS},
+    **{f"{slot}_deadline": None for slot in RIGHT_DONOR_SLOTS},
+})
+_SPLIT_CLEAR = {"left": _LEFT_CLEAR, "right": _RIGHT_CLEAR}
+
+
+def _clear_bits(keep_mask: int):
+    """SQL: occupancy_mask & keep_mask (сброс битов освобождённых слотов)."""
+    return Table.occupancy_mask.op("&")(keep_mask)
+
+
+def _donor_match(slot: str):
+    """Условие: в слоте сидит donor_tid и ещё не оплатил."""
+    return and_(
+        getattr(Table, slot) == bindparam("donor_tid"),
+        getattr(Table, f"{slot}_pay") == False,
+    )
+
+
+# Подтверждение оплаты одним UPDATE ... RETURNING (без загрузки доски)
+_CONFIRM_PAYMENT_QUERY = (
+    update(Table)
+    .where(
+        and_(
+            Table.id == bindparam("table_id"),
+            or_(*[_donor_match(slot) for slot in DONOR_SLOTS]),
+        )
+    )
+    .values({
+        **{
+            f"{slot}_pay": case(
+                (getattr(Table, slot) == bindparam("donor_tid"), True),
+                else_=getattr(Table, f"{slot}_pay"),
+            )
+            for slot in DONOR_SLOTS
+        },
+        "gifts_received": Table.gifts_received + 1,
+    })
+    .returning(
+        Table.gifts_received,
+        *[getattr(Table, slot) for slot in DONOR_SLOTS],
+        *[getattr(Table, f"{slot}_pay") for slot in DONOR_SLOTS],
+    )
+    .execution_options(synchronize_session=False)
+)
+
+# Выход неоплатившего дарителя одним UPDATE ... RETURNING
+_LEAVE_TABLE_QUERY = (
+    update(Table)
+    .where(
+        and_(
+            Table.id == bindparam("table_id"),
+            or_(*[_donor_match(slot) for slot in DONOR_SLOTS]),
+        )
+    )
+    .values({
+        **{
+            column: case(
+                (_donor_match(slot), None),
+                else_=getattr(Table, column),
+            )
+            for slot in DONOR_SLOTS
+            for column in (slot, f"{slot}_deadline")
+        },
+        "occupancy_mask": case(
+            *[
+                (_donor_match(slot), _clear_bits(FULL_OCCUPANCY_MASK ^ SLOT_BITS[slot]))
+                for slot in DONOR_SLOTS
+            ],
+            else_=Table.occupancy_mask,
+        ),
+    })
+    .returning(
+        *[getattr(Table, slot) for slot in DONOR_SLOTS],
+        *[getattr(Table, f"{slot}_deadline") for slot in DONOR_SLOTS],
+        Table.occupancy_mask,
+    )
+    .execution_options(synchronize_session=False)
+)
+
+# Освобождение слота дарителя (по запросу на слот)
+_KICK_DONOR_QUERIES = {
+    slot: (
+        update(Table)
+        .where(Table.id == bindparam("table_id"))
+        .values({
+            slot: None,
+            f"{slot}_deadline": None,
+            f"{slot}_pay": False,
+            "occupancy_mask": _clear_bits(FULL_OCCUPANCY_MASK ^ SLOT_BITS[slot]),
+        })
+        .returning(
+            getattr(Table, slot),
+            getattr(Table, f"{slot}_deadline"),
+            getattr(Table, f"{slot}_pay"),
+            Table.occupancy_mask,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    for slot in DONOR_SLOTS
+}
+
+
+# Все просроченные дарители по всем активным доскам: UNION ALL по 8 слотам
+_ALL_EXPIRED_DONORS_QUERY = union_all(*[
+    select(
+        Table.id.label("table_id"),
+        literal(slot).label("slot"),
+        getattr(Table, slot).label("tid"),
+    ).where(
+        and_(
+            Table.isactive == True,
+            getattr(Table, slot) != None,
+            getattr(Table, f"{slot}_pay") == False,
+            getattr(Table, f"{slot}_deadline") != None,
+            getattr(Table, f"{slot}_deadline") < bindparam("now", type_=BigInteger),
+        )
+    )
+    for slot in DONOR_SLOTS
+])
+
+
+# "tid уже сидит на открытой доске уровня level" (индекс по table_members)
+_ON_LEVEL_CONDITION = and_(
+    TableMember.tid == bindparam("tid"),
+    TableMember.level == bindparam("level"),
+    TableMember.isactive == True,
+)
+
+_ON_LEVEL_QUERY = select(TableMember.table_id).where(_ON_LEVEL_CONDITION).limit(1)
+
+# Все биты уровней (для снятия одного бита в active_level_mask)
+_ALL_LEVELS_MASK = sum(1 << level for level in LEVELS)
+
+# Кэш цепочек наставников: {(tid, depth): (время, tid наставников)}
+UPLINE_CACHE_TTL = 60
+UPLINE_CACHE_MAX_SIZE = 4096
+_upline_cache: Dict[Tuple[int, int], Tuple[int, Tuple[int, ...]]] = {}
+
+# Человекочитаемые названия позиций
+POSITION_NAMES: Mapping[str, str] = MappingProxyType({
+    'rec': '🎁 Получатель',
+    'crl': '⭐ Создатель (Л)',
+    'crr': '⭐ Создатель (П)',
+    'stl1': '🔨 Строитель 1',
+    'stl2': '🔨 Строитель 2',
+    'str3': '🔨 Строитель 3',
+    'str4': '🔨 Строитель 4',
+    'dl1': '🎀 Даритель 1',
+    'dl2': '🎀 Даритель 2',
+    'dl3': '🎀 Даритель 3',
+    'dl4': '🎀 Даритель 4',
+    'dr5': '🎀 Даритель 5',
+    'dr6': '🎀 Даритель 6',
+    'dr7': '🎀 Даритель 7',
+    'dr8': '🎀 Даритель 8',
+})
+
+
+@lru_cache(maxsize=16)
+def _level_name(level: int) -> str:
+    """Название уровня для статистики."""
+    return LEVELS.get(level, {}).get("name", "Unknown")
 
 
 class JoinResult(str, Enum):
@@ -45,25 +304,7 @@ class TableService:
         Проверить находится ли пользователь на доске этого уровня.
         Критично: нельзя быть на двух досках одного уровня!
         """
-        query = select(Table.id).where(
-            and_(
-                Table.level == level,
-                Table.isactive == True,
-                Table.status != TableStatus.CLOSED.value,
-                or_(
-                    Table.rec == tid,
-                    Table.crl == tid, Table.crr == tid,
-                    Table.stl1 == tid, Table.stl2 == tid,
-                    Table.str3 == tid, Table.str4 == tid,
-                    Table.dl1 == tid, Table.dl2 == tid,
-                    Table.dl3 == tid, Table.dl4 == tid,
-                    Table.dr5 == tid, Table.dr6 == tid,
-                    Table.dr7 == tid, Table.dr8 == tid,
-                )
-            )
-        ).limit(1)
-        
-        result = await self.session.execute(query)
+        result = await self.session.execute(_ON_LEVEL_QUERY, {"tid": tid, "level": level})
         return result.scalar_one_or_none() is not None
 
     async def can_user_join(self, tid: int, level: int) -> Tuple[bool, str]:
@@ -73,25 +314,36 @@ class TableService:
         Returns:
             Tuple[can_join, reason]
         """
+        _, reason = await self._check_join(tid, level)
+        return reason == "OK", reason
+
+    async def _check_join(self, tid: int, level: int) -> Tuple[Optional[User], str]:
+        """
+        Проверка возможности сесть на доску одним запросом:
+        "уже на уровне" читается из User.active_level_mask.
+        
+        Returns:
+            Tuple[user, reason]
+        """
         user = await self.user_service.get_by_tid(tid)
         
-        if not user:
-            return False, JoinResult.USER_NOT_FOUND.value
+        if user is None:
+            return None, JoinResult.USER_NOT_FOUND.value
         
         if user.isblocked:
-            return False, JoinResult.USER_BLOCKED.value
+            return user, JoinResult.USER_BLOCKED.value
         
         if user.is_banned:
-            return False, JoinResult.USER_BLOCKED.value
+            return user, JoinResult.USER_BLOCKED.value
         
         # TODO: Раскомментировать когда активность будет обязательной
         # if user.is_dormant:
-        #     return False, JoinResult.USER_DORMANT.value
+        #     return user, JoinResult.USER_DORMANT.value
         
-        if await self.is_user_on_level(tid, level):
-            return False, JoinResult.USER_ALREADY_ON_LEVEL.value
+        if user.is_on_level(level):
+            return user, JoinResult.USER_ALREADY_ON_LEVEL.value
         
-        return True, "OK"
+        return user, "OK"
 
     # ===========================================
     # СОЗДАНИЕ ДОСКИ
@@ -121,6 +373,7 @@ class TableService:
             parent_id=parent_id,
             split_side=split_side,
             rec=creator_tid,
+            occupancy_mask=SLOT_BITS['rec'],
             status=TableStatus.WAITING.value,
             isactive=True,
             gifts_received=0,
@@ -128,11 +381,13 @@ class TableService:
         
         self.session.add(table)
         try:
-            await self.session.commit()
-            await self.session.refresh(table)
+            await self.session.flush()  # Нужен table.id для table_members
+            self._add_member(table, 'rec', creator_tid)
+            await self._set_level_flag([creator_tid], level, True)
+            await commit_or_flush(self.session)
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при создании доски level={level} creator={creator_tid}: {e}")
+            alert_nowait(f"Ошибка при создании доски level={level} creator={creator_tid}: {e}")
             raise e
         
         return table
@@ -162,26 +417,26 @@ class TableService:
         Returns:
             Tuple[Table, reason]
         """
-        # Шаг 0: Проверки
-        can_join, reason = await self.can_user_join(user_tid, level)
-        if not can_join:
+        # Шаг 0: Проверки (пользователь и "уже на уровне" — одним запросом)
+        _, reason = await self._check_join(user_tid, level)
+        if reason != "OK":
             return None, reason
         
-        user = await self.user_service.get_by_tid(user_tid)
+        # Шаг 1: Получаем цепочку наставников (кэш на UPLINE_CACHE_TTL секунд)
+        upline_tids = await self._get_upline_tids(user_tid, depth=100)
         
-        # Шаг 1: Получаем цепочку наставников
-        upline = await self.user_service.get_upline(user_tid, depth=100)
-        
-        # Шаг 2: Ищем доску по цепочке наставников
-        for mentor in upline:
+        # Шаг 2: Ищем доску по цепочке наставников (доски всех наставников — одним запросом)
+        tables_by_rec = await self._find_receiver_tables(list(upline_tids), level)
+        for mentor_tid in upline_tids:
             # Пропускаем спящих наставников (компрессия)
             # TODO: Раскомментировать когда активность обязательна
+            # (кэшируются только tid — проверку делать по свежим данным пользователя)
             # if mentor.is_dormant:
             #     continue
             
-            table = await self._find_receiver_table(mentor.tid, level)
-            if table and table.empty_slots_total > 0:
-                return table, f"MENTOR_{mentor.tid}"
+            table = tables_by_rec.get(mentor_tid)
+            if table:
+                return table, f"MENTOR_{mentor_tid}"
         
         # Шаг 3: Глобальный перелив (самые старые доски первыми - FIFO)
         table = await self._find_any_open_table(level)
@@ -190,21 +445,41 @@ class TableService:
         
         return None, "NO_TABLES_AVAILABLE"
 
+    async def _get_upline_tids(self, tid: int, depth: int) -> Tuple[int, ...]:
+        """
+        tid цепочки наставников (от ближайшего к дальнему) с кэшем.
+        Связь с наставником задаётся при регистрации и не меняется,
+        поэтому повторные попытки входа не обходят цепочку заново.
+        """
+        key = (tid, depth)
+        now = now_ts()
+        cached = _upline_cache.get(key)
+        if cached is not None and now - cached[0] < UPLINE_CACHE_TTL:
+            return cached[1]
+        
+        upline = await self.user_service.get_upline(tid, depth=depth)
+        upline_tids = tuple(mentor.tid for mentor in upline)
+        
+        # Чистим протухшие записи, чтобы кэш не рос бесконечно
+        if len(_upline_cache) >= UPLINE_CACHE_MAX_SIZE:
+            for stale_key in [k for k, v in _upline_cache.items() if now - v[0] >= UPLINE_CACHE_TTL]:
+                _upline_cache.pop(stale_key, None)
+            if len(_upline_cache) >= UPLINE_CACHE_MAX_SIZE:
+                _upline_cache.clear()
+        _upline_cache[key] = (now, upline_tids)
+        
+        return upline_tids
+
     async def find_receiver_table(
         self,
         receiver_tid: int,
         level: int,
     ) -> Optional[Table]:
         """Найти активную доску где tid — получатель (Receiver)."""
-        query = select(Table).where(
-            and_(
-                Table.rec == receiver_tid,
-                Table.level == level,
-                Table.isactive == True,
-                Table.status.in_([TableStatus.WAITING.value, TableStatus.ACTIVE.value]),
-            )
+        result = await self.session.execute(
+            _RECEIVER_TABLE_QUERY,
+            {"receiver_tid": receiver_tid, "level": level},
         )
-        result = await self.session.execute(query)
         return result.scalar_one_or_none()
 
     async def _find_receiver_table(
@@ -215,34 +490,36 @@ class TableService:
         """Приватный метод (для внутреннего использования)."""
         return await self.find_receiver_table(receiver_tid, level)
 
+    async def _find_receiver_tables(
+        self,
+        receiver_tids: List[int],
+        level: int,
+    ) -> Dict[int, Table]:
+        """
+        Найти доски со свободными местами, где получатели — receiver_tids.
+        
+        Returns:
+            Dict[rec_tid, Table]
+        """
+        if not receiver_tids:
+            return {}
+        
+        result = await self.session.execute(
+            _RECEIVER_TABLES_BATCH_QUERY,
+            {"receiver_tids": receiver_tids, "level": level},
+        )
+        tables_by_rec = {}
+        for table in result.scalars():
+            if table.empty_slots_total > 0:
+                tables_by_rec.setdefault(table.rec, table)
+        return tables_by_rec
+
     async def _find_any_open_table(self, level: int) -> Optional[Table]:
         """
         Найти любую открытую доску (глобальный перелив).
         Приоритет: самые старые (FIFO) + почти заполненные.
         """
-        query = (
-            select(Table)
-            .where(
-                and_(
-                    Table.level == level,
-                    Table.isactive == True,
-                    Table.status.in_([TableStatus.WAITING.value, TableStatus.ACTIVE.value]),
-                    # Хотя бы одно место свободно
-                    or_(
-                        Table.dl1 == None, Table.dl2 == None,
-                        Table.dl3 == None, Table.dl4 == None,
-                        Table.dr5 == None, Table.dr6 == None,
-                        Table.dr7 == None, Table.dr8 == None,
-                    )
-                )
-            )
-            .order_by(
-                Table.gifts_received.desc(),  # Приоритет заполненным
-                Table.created_at.asc(),       # Потом по старшинству
-            )
-            .limit(1)
-        )
-        result = await self.session.execute(query)
+        result = await self.session.execute(_ANY_OPEN_TABLE_QUERY, {"level": level})
         return result.scalar_one_or_none()
 
     # ===========================================
@@ -275,7 +552,7 @@ class TableService:
             return False, JoinResult.TABLE_CLOSED.value, None
         
         # Проверяем что пользователь не на этой доске
-        if await self._is_user_on_table(table, user_tid):
+        if self._is_user_on_table(table, user_tid):
             return False, JoinResult.ALREADY_ON_TABLE.value, None
         
         # Проверяем что не на другой доске этого уровня
@@ -295,35 +572,32 @@ class TableService:
             return False, JoinResult.NO_SLOTS.value, None
         
         # Занимаем место
-        now = int(time.time())
+        now = now_ts()
         deadline = now + PAYMENT_TIMEOUT
         
         setattr(table, slot, user_tid)
         setattr(table, f"{slot}_deadline", deadline)
         setattr(table, f"{slot}_pay", False)
+        table.occupancy_mask |= SLOT_BITS[slot]
+        self._add_member(table, slot, user_tid)
+        await self._set_level_flag([user_tid], table.level, True)
         
         # Обновляем статус доски
         if table.status == TableStatus.WAITING.value:
             table.status = TableStatus.ACTIVE.value
         
         try:
-            await self.session.commit()
+            await commit_or_flush(self.session)
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при присоединении к доске table_id={table_id} user={user_tid}: {e}")
+            alert_nowait(f"Ошибка при присоединении к доске table_id={table_id} user={user_tid}: {e}")
             raise e
         
         return True, JoinResult.SUCCESS.value, slot
 
-    async def _is_user_on_table(self, table: Table, tid: int) -> bool:
+    def _is_user_on_table(self, table: Table, tid: int) -> bool:
         """Проверить находится ли пользователь на этой доске."""
-        positions = [
-            table.rec, table.crl, table.crr,
-            table.stl1, table.stl2, table.str3, table.str4,
-            table.dl1, table.dl2, table.dl3, table.dl4,
-            table.dr5, table.dr6, table.dr7, table.dr8,
-        ]
-        return tid in positions
+        return tid in table.slot_tids
 
     async def leave_table(
         self,
@@ -336,32 +610,48 @@ class TableService:
         Returns:
             Tuple[success, reason]
         """
-        table = await self.get_by_id(table_id)
-        if not table:
-            return False, "TABLE_NOT_FOUND"
-        
-        donor_slots = ['dl1', 'dl2', 'dl3', 'dl4', 'dr5', 'dr6', 'dr7', 'dr8']
-        
-        for slot in donor_slots:
-            if getattr(table, slot) == user_tid:
-                # Проверяем не оплатил ли уже
-                if getattr(table, f"{slot}_pay"):
-                    return False, "ALREADY_PAID"
-                
-                # Освобождаем место
-                setattr(table, slot, None)
-                setattr(table, f"{slot}_deadline", None)
-                setattr(table, f"{slot}_pay", False)
-                
-                try:
-                    await self.session.commit()
-                except IntegrityError as e:
-                    await self.session.rollback()
-                    await alert(f"Ошибка при покидании доски table_id={table_id} user={user_tid}: {e}")
-                    raise e
-                return True, f"LEFT_{slot.upper()}"
-        
-        return False, "NOT_A_DONOR"
+        result = await self.session.execute(
+            _LEAVE_TABLE_QUERY,
+            {"table_id": table_id, "donor_tid": user_tid},
+        )
+        row = result.one_or_none()
+        
+        if row is None:
+            # Медленный путь только для отказа: выясняем причину
+            table = await self.get_by_id(table_id)
+            if not table:
+                return False, "TABLE_NOT_FOUND"
+            if user_tid in table.left_donors or user_tid in table.right_donors:
+                return False, "ALREADY_PAID"
+            return False, "NOT_A_DONOR"
+        
+        self._apply_returned(table_id, row)
+        
+        # Какой слот освободился — узнаём из table_members
+        result = await self.session.execute(
+            delete(TableMember)
+            .where(
+                and_(
+                    TableMember.table_id == table_id,
+                    TableMember.tid == user_tid,
+                    TableMember.slot.in_(DONOR_SLOTS),
+                )
+            )
+            .returning(TableMember.slot, TableMember.level)
+        )
+        member = result.one_or_none()
+        slot = None
+        if member is not None:
+            slot = member.slot
+            await self._set_level_flag([user_tid], member.level, False)
+        
+        try:
+            await commit_or_flush(self.session)
+        except IntegrityError as e:
+            await self.session.rollback()
+            alert_nowait(f"Ошибка при покидании доски table_id={table_id} user={user_tid}: {e}")
+            raise e
+        return True, f"LEFT_{(slot or 'DONOR').upper()}"
 
     # ===========================================
     # ПОДТВЕРЖДЕНИЕ ОПЛАТЫ
@@ -384,45 +674,39 @@ class TableService:
         Returns:
             Tuple[success, message, split_ready_side]
         """
-        table = await self.get_by_id(table_id)
-        if not table:
-            return False, "TABLE_NOT_FOUND", None
-        
-        # Ищем дарителя
-        donor_slots = ['dl1', 'dl2', 'dl3', 'dl4', 'dr5', 'dr6', 'dr7', 'dr8']
-        slot_found = None
-        
-        for slot in donor_slots:
-            if getattr(table, slot) == donor_tid:
-                slot_found = slot
-                break
-        
-        if not slot_found:
+        result = await self.session.execute(
+            _CONFIRM_PAYMENT_QUERY,
+            {"table_id": table_id, "donor_tid": donor_tid},
+        )
+        row = result.one_or_none()
+        
+        if row is None:
+            # Медленный путь только для отказа: выясняем причину
+            table = await self.get_by_id(table_id)
+            if not table:
+                return False, "TABLE_NOT_FOUND", None
+            if donor_tid in table.left_donors or donor_tid in table.right_donors:
+                return False, "ALREADY_CONFIRMED", None
             return False, "DONOR_NOT_FOUND", None
         
-        # Проверяем не оплачен ли уже
-        if getattr(table, f"{slot_found}_pay"):
-            return False, "ALREADY_CONFIRMED", None
-        
-        # Подтверждаем оплату
-        setattr(table, f"{slot_found}_pay", True)
-        table.gifts_received += 1
+        self._apply_returned(table_id, row)
         
         try:
-            await self.session.commit()
+            await commit_or_flush(self.session)
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при подтверждении оплаты table_id={table_id} donor={donor_tid}: {e}")
+            alert_nowait(f"Ошибка при подтверждении оплаты table_id={table_id} donor={donor_tid}: {e}")
             raise e
         
         # Проверяем готовность к разделению
+        values = row._mapping
         split_side = None
-        if table.can_split_left:
+        if all(values[slot] is not None and values[f"{slot}_pay"] for slot in LEFT_DONOR_SLOTS):
             split_side = "left"
-        elif table.can_split_right:
+        elif all(values[slot] is not None and values[f"{slot}_pay"] for slot in RIGHT_DONOR_SLOTS):
             split_side = "right"
         
-        msg = f"GIFT_{table.gifts_received}_OF_8"
+        msg = f"GIFT_{row.gifts_received}_OF_8"
         if split_side:
             msg += f"_READY_SPLIT_{split_side.upper()}"
         
@@ -500,68 +784,226 @@ class TableService:
             str3=new_str3,
             str4=new_str4,
         )
+        new_table.occupancy_mask = sum(
+            SLOT_BITS[slot] for slot, tid in zip(SLOT_NAMES, new_table.slot_tids) if tid
+        )
         
         self.session.add(new_table)
         
-        # Очищаем отделившуюся сторону
-        if side == "left":
-            table.crl = None
-            table.stl1 = None
-            table.stl2 = None
-            table.dl1 = None
-            table.dl2 = None
-            table.dl3 = None
-            table.dl4 = None
-            table.dl1_pay = False
-            table.dl2_pay = False
-            table.dl3_pay = False
-            table.dl4_pay = False
-            table.dl1_deadline = None
-            table.dl2_deadline = None
-            table.dl3_deadline = None
-            table.dl4_deadline = None
-        else:
-            table.crr = None
-            table.str3 = None
-            table.str4 = None
-            table.dr5 = None
-            table.dr6 = None
-            table.dr7 = None
-            table.dr8 = None
-            table.dr5_pay = False
-            table.dr6_pay = False
-            table.dr7_pay = False
-            table.dr8_pay = False
-            table.dr5_deadline = None
-            table.dr6_deadline = None
-            table.dr7_deadline = None
-            table.dr8_deadline = None
+        # Очищаем отделившуюся сторону одним UPDATE (без поатрибутной записи через ORM)
+        await self._remove_members(table.id, SPLIT_SLOTS[side])
+        cleared = dict(_SPLIT_CLEAR[side])
         
         # Закрываем если все 8 подарков получены
         if table.is_complete:
-            table.status = TableStatus.CLOSED.value
-            table.isactive = False
-            table.closed_at = int(time.time())
+            cleared.update(
+                status=TableStatus.CLOSED.value,
+                isactive=False,
+                closed_at=now_ts(),
+            )
+            await self.session.execute(
+                update(TableMember)
+                .where(TableMember.table_id == table.id)
+                .values(isactive=False)
+            )
+            # Оставшиеся на закрытой доске больше не на этом уровне
+            await self._set_level_flag(
+                select(TableMember.tid).where(TableMember.table_id == table.id),
+                table.level,
+                False,
+            )
+        
+        result = await self.session.execute(
+            update(Table)
+            .where(Table.id == table.id)
+            .values(
+                **cleared,
+                occupancy_mask=_clear_bits(
+                    FULL_OCCUPANCY_MASK ^ sum(SLOT_BITS[slot] for slot in SPLIT_SLOTS[side])
+                ),
+            )
+            .returning(*[getattr(Table, column) for column in cleared], Table.occupancy_mask)
+            .execution_options(synchronize_session=False)
+        )
+        self._apply_returned(table.id, result.one())
         
         try:
-            await self.session.commit()
-            await self.session.refresh(new_table)
+            # Участники новой доски (нужен new_table.id)
+            await self.session.flush()
+            movers = []
+            for slot in ('rec', 'crl', 'crr', 'stl1', 'stl2', 'str3', 'str4'):
+                tid = getattr(new_table, slot)
+                if tid:
+                    self._add_member(new_table, slot, tid)
+                    movers.append(tid)
+            await self._set_level_flag(movers, new_table.level, True)
+            await commit_or_flush(self.session)
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при разделении доски table_id={table_id} side={side}: {e}")
+            alert_nowait(f"Ошибка при разделении доски table_id={table_id} side={side}: {e}")
             raise e
         
         return True, f"SPLIT_{side.upper()}_TABLE_{new_table.id}", new_table
 
+    async def confirm_payment_and_split(
+        self,
+        table_id: int,
+        donor_tid: int,
+        tx_hash: Optional[str] = None,
+    ) -> Tuple[bool, str, Optional[Table]]:
+        """
+        Подтвердить подарок и, если сторона собрана, сразу разделить доску.
+        Одна транзакция: доска не остаётся с собранной, но не отделённой стороной.
+        
+        Returns:
+            Tuple[success, message, new_table]
+        """
+        async with unit_of_work(self.session):
+            success, msg, split_side = await self.confirm_payment(table_id, donor_tid, tx_hash)
+            if not success or not split_side:
+                return success, msg, None
+            
+            split_ok, split_msg, new_table = await self.split_table(table_id, split_side)
+            if not split_ok:
+                return True, msg, None
+            return True, split_msg, new_table
+
+    # ===========================================
+    # УЧАСТНИКИ ДОСОК (table_members)
+    # ===========================================
+
+    def _add_member(self, table: Table, slot: str, tid: int):
+        """Добавить строку участия (коммит — вместе с изменением слота)."""
+        self.session.add(TableMember(
+            table_id=table.id,
+            level=table.level,
+            tid=tid,
+            slot=slot,
+            isactive=table.isactive,
+        ))
+
+    async def _remove_members(self, table_id: int, slots: Tuple[str, ...]):
+        """Удалить строки участия для освобождённых слотов."""
+        await self.session.execute(
+            delete(TableMember).where(
+                and_(TableMember.table_id == table_id, TableMember.slot.in_(slots))
+            )
+        )
+
+    def _apply_returned(self, table_id: int, row, model=Table):
+        """
+        Перенести значения из RETURNING в загруженный экземпляр (если он в сессии),
+        чтобы identity map не отдавал устаревшие данные после Core UPDATE.
+        """
+        obj = self.session.identity_map.get(identity_key(model, table_id))
+        if obj is not None:
+            for key, value in row._mapping.items():
+                set_committed_value(obj, key, value)
+
+    async def _set_level_flag(self, tids, level: int, on: bool):
+        """
+        Выставить/снять бит уровня в User.active_level_mask.
+        
+        Args:
+            tids: список tid или подзапрос, возвращающий tid
+        """
+        bit = 1 << level
+        mask = (
+            User.active_level_mask.op("|")(bit)
+            if on
+            else User.active_level_mask.op("&")(_ALL_LEVELS_MASK ^ bit)
+        )
+        result = await self.session.execute(
+            update(User)
+            .where(User.tid.in_(tids))
+            .values(active_level_mask=mask)
+            .returning(User.id, User.tid, User.active_level_mask)
+            .execution_options(synchronize_session=False)
+        )
+        for row in result:
+            mark_user_changed(self.session, row.tid)
+            self._apply_returned(row.id, row, model=User)
+
+    async def rebuild_level_masks(self):
+        """
+        Пересчитать User.active_level_mask по table_members.
+        Нужно один раз после добавления колонки на существующей базе.
+        """
+        mark_all_users_changed(self.session)
+        try:
+            await self.session.execute(
+                update(User)
+                .values(active_level_mask=0)
+                .execution_options(synchronize_session=False)
+            )
+            for level in LEVELS:
+                await self.session.execute(
+                    update(User)
+                    .where(
+                        User.tid.in_(
+                            select(TableMember.tid).where(
+                                and_(TableMember.level == level, TableMember.isactive == True)
+                            )
+                        )
+                    )
+                    .values(active_level_mask=User.active_level_mask.op("|")(1 << level))
+                    .execution_options(synchronize_session=False)
+                )
+            await commit_or_flush(self.session)
+        except IntegrityError as e:
+            await self.session.rollback()
+            alert_nowait(f"Ошибка при пересчёте active_level_mask: {e}")
+            raise e
+
+    async def rebuild_occupancy(self):
+        """
+        Пересчитать occupancy_mask всех досок по слотам.
+        Нужно один раз после добавления колонки на существующей базе.
+        """
+        try:
+            await self.session.execute(
+                update(Table)
+                .values(occupancy_mask=sum(
+                    case((getattr(Table, slot) != None, SLOT_BITS[slot]), else_=0)
+                    for slot in SLOT_NAMES
+                ))
+                .execution_options(synchronize_session=False)
+            )
+            await commit_or_flush(self.session)
+        except IntegrityError as e:
+            await self.session.rollback()
+            alert_nowait(f"Ошибка при пересчёте occupancy_mask: {e}")
+            raise e
+
+    async def rebuild_members(self):
+        """
+        Пересобрать table_members из слотов всех досок.
+        Нужно один раз после создания таблицы на существующей базе.
+        """
+        try:
+            await self.session.execute(delete(TableMember))
+            for slot in SLOT_NAMES:
+                column = getattr(Table, slot)
+                await self.session.execute(
+                    insert(TableMember).from_select(
+                        ["table_id", "level", "tid", "slot", "isactive"],
+                        select(Table.id, Table.level, column, literal(slot), Table.isactive)
+                        .where(column != None),
+                    )
+                )
+            await commit_or_flush(self.session)
+        except IntegrityError as e:
+            await self.session.rollback()
+            alert_nowait(f"Ошибка при пересборке table_members: {e}")
+            raise e
+
     # ===========================================
     # ПОЛУЧЕНИЕ ДАННЫХ
     # ===========================================
 
     async def get_by_id(self, table_id: int) -> Optional[Table]:
-        """Получить доску по ID."""
-        query = select(Table).where(Table.id == table_id)
-        result = await self.session.execute(query)
-        return result.scalar_one_or_none()
+        """Получить доску по ID (из identity map сессии без запроса, если уже загружена)."""
+        return await self.session.get(Table, table_id, options=_TABLE_LOAD_OPTIONS)
 
     async def get_user_tables(
         self,
@@ -569,68 +1011,50 @@ class TableService:
         active_only: bool = True,
     ) -> List[Table]:
         """Получить все доски пользователя."""
-        conditions = [
-            or_(
-                Table.rec == user_tid,
-                Table.crl == user_tid, Table.crr == user_tid,
-                Table.stl1 == user_tid, Table.stl2 == user_tid,
-                Table.str3 == user_tid, Table.str4 == user_tid,
-                Table.dl1 == user_tid, Table.dl2 == user_tid,
-                Table.dl3 == user_tid, Table.dl4 == user_tid,
-                Table.dr5 == user_tid, Table.dr6 == user_tid,
-                Table.dr7 == user_tid, Table.dr8 == user_tid,
-            )
-        ]
+        conditions = [TableMember.tid == user_tid]
         
         if active_only:
-            conditions.append(Table.isactive == True)
+            conditions.append(TableMember.isactive == True)
         
         query = (
             select(Table)
+            .options(*_TABLE_LOAD_OPTIONS)
+            .join(TableMember, TableMember.table_id == Table.id)
             .where(and_(*conditions))
             .order_by(Table.level, Table.created_at.desc())
         )
         result = await self.session.execute(query)
         return list(result.scalars().all())
 
-    async def get_user_position(self, table: Table, user_tid: int) -> Optional[str]:
+    def get_user_position(self, table: Table, user_tid: int) -> Optional[str]:
         """Определить позицию пользователя на доске."""
-        positions = {
-            'rec': table.rec,
-            'crl': table.crl, 'crr': table.crr,
-            'stl1': table.stl1, 'stl2': table.stl2,
-            'str3': table.str3, 'str4': table.str4,
-            'dl1': table.dl1, 'dl2': table.dl2,
-            'dl3': table.dl3, 'dl4': table.dl4,
-            'dr5': table.dr5, 'dr6': table.dr6,
-            'dr7': table.dr7, 'dr8': table.dr8,
-        }
-        
-        for pos, tid in positions.items():
-            if tid == user_tid:
-                return pos
+        tids = table.slot_tids
+        if user_tid in tids:
+            return SLOT_NAMES[tids.index(user_tid)]
         return None
 
-    async def get_position_name(self, position: str) -> str:
+    def get_position_name(self, position: str) -> str:
         """Человекочитаемое название позиции."""
-        names = {
-            'rec': '🎁 Получатель',
-            'crl': '⭐ Создатель (Л)',
-            'crr': '⭐ Создатель (П)',
-            'stl1': '🔨 Строитель 1',
-            'stl2': '🔨 Строитель 2',
-            'str3': '🔨 Строитель 3',
-            'str4': '🔨 Строитель 4',
-            'dl1': '🎀 Даритель 1',
-            'dl2': '🎀 Даритель 2',
-            'dl3': '🎀 Даритель 3',
-            'dl4': '🎀 Даритель 4',
-            'dr5': '🎀 Даритель 5',
-            'dr6': '🎀 Даритель 6',
-            'dr7': '🎀 Даритель 7',
-            'dr8': '🎀 Даритель 8',
-        }
-        return names.get(position, position)
+        return POSITION_NAMES.get(position, position)
+
+    def get_user_positions_bulk(
+        self,
+        tables: List[Table],
+        user_tid: int,
+    ) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+        """
+        Позиции пользователя на нескольких досках за один проход (без запросов к БД).
+        
+        Returns:
+            {table.id: (позиция, название позиции)}; (None, None) — не на доске
+        """
+        positions = {}
+        for table in tables:
+            position = self.get_user_position(table, user_tid)
+            positions[table.id] = (
+                (position, POSITION_NAMES.get(position, position)) if position else (None, None)
+            )
+        return positions
 
     # ===========================================
     # УПРАВЛЕНИЕ ТАЙМЕРАМИ
@@ -642,20 +1066,33 @@ class TableService:
         if not table:
             return []
         
-        now = int(time.time())
-        expired = []
+        now = now_ts()
+        tids, pays, deadlines = table.snapshot()
         
-        donor_slots = ['dl1', 'dl2', 'dl3', 'dl4', 'dr5', 'dr6', 'dr7', 'dr8']
-        
-        for slot in donor_slots:
-            tid = getattr(table, slot)
-            deadline = getattr(table, f"{slot}_deadline")
-            is_paid = getattr(table, f"{slot}_pay")
-            
-            if tid and deadline and not is_paid and now > deadline:
-                expired.append((slot, tid))
+        # Дарители — позиции 7..14 в порядке SLOT_NAMES
+        return [
+            (slot, tid)
+            for slot, tid, is_paid, deadline in zip(
+                SLOT_NAMES[7:], tids[7:], pays[7:], deadlines[7:]
+            )
+            if tid and deadline and not is_paid and now > deadline
+        ]
+
+    async def get_all_expired_donors(
+        self,
+        now: Optional[int] = None,
+    ) -> List[Tuple[int, str, int]]:
+        """
+        Дарители с истёкшим таймером оплаты на всех активных досках — одним запросом
+        (для планировщика вместо get_expired_donors по каждой доске).
         
-        return expired
+        Returns:
+            List[(table_id, slot, tid)]
+        """
+        if now is None:
+            now = now_ts()
+        result = await self.session.execute(_ALL_EXPIRED_DONORS_QUERY, {"now": now})
+        return [(row.table_id, row.slot, row.tid) for row in result]
 
     async def kick_donor(
         self,
@@ -674,51 +1111,54 @@ class TableService:
         Returns:
             Tuple[success, kicked_tid]
         """
-        table = await self.get_by_id(table_id)
-        if not table:
-            return False, 0
-        
-        tid = getattr(table, slot)
-        if not tid:
+        query = _KICK_DONOR_QUERIES.get(slot)
+        if query is None:
             return False, 0
         
-        # Очищаем место
-        setattr(table, slot, None)
-        setattr(table, f"{slot}_deadline", None)
-        setattr(table, f"{slot}_pay", False)
-        
-        # Применяем блокировку
-        if apply_ban:
-            hours = await self.user_service.apply_ban(tid)
-        
-        try:
-            await self.session.commit()
-        except IntegrityError as e:
-            await self.session.rollback()
-            await alert(f"Ошибка при удалении дарителя table_id={table_id} slot={slot}: {e}")
-            raise e
+        # Освобождение места и бан — одна транзакция (apply_ban сам коммитит)
+        async with unit_of_work(self.session):
+            # Кто сидел в слоте — из table_members (UPDATE вернул бы уже пустой слот)
+            result = await self.session.execute(
+                delete(TableMember)
+                .where(and_(TableMember.table_id == table_id, TableMember.slot == slot))
+                .returning(TableMember.tid, TableMember.level)
+            )
+            member = result.one_or_none()
+            if member is None or not member.tid:
+                return False, 0
+            tid = member.tid
+            await self._set_level_flag([tid], member.level, False)
+            
+            # Очищаем место
+            result = await self.session.execute(query, {"table_id": table_id})
+            self._apply_returned(table_id, result.one())
+            
+            # Применяем блокировку
+            if apply_ban:
+                await self.user_service.apply_ban(tid)
+            
+            try:
+                await commit_or_flush(self.session)
+            except IntegrityError as e:
+                await self.session.rollback()
+                alert_nowait(f"Ошибка при удалении дарителя table_id={table_id} slot={slot}: {e}")
+                raise e
         
         return True, tid
 
     async def get_tables_stats(self, level: int) -> dict:
-        """Статистика досок на уровне."""
-        # Активные
-        active_query = select(func.count(Table.id)).where(
-            and_(Table.level == level, Table.isactive == True)
-        )
-        active_result = await self.session.execute(active_query)
-        active_count = active_result.scalar() or 0
-        
-        # Закрытые
-        closed_query = select(func.count(Table.id)).where(
-            and_(Table.level == level, Table.status == TableStatus.CLOSED.value)
-        )
-        closed_result = await self.session.execute(closed_query)
-        closed_count = closed_result.scalar() or 0
+        """Статистика досок на уровне (обе выборки — одним запросом через FILTER)."""
+        query = select(
+            func.count().filter(Table.isactive == True).label("active"),
+            func.count().filter(Table.status == TableStatus.CLOSED.value).label("closed"),
+        ).where(Table.level == level)
+        row = (await self.session.execute(query)).one()
+        active_count = row.active or 0
+        closed_count = row.closed or 0
         
         return {
             "level": level,
-            "level_name": LEVELS.get(level, {}).get("name", "Unknown"),
+            "level_name": _level_name(level),
             "active": active_count,
             "closed": closed_count,
             "total": active_count + closed_count,
@@ -2,14 +2,19 @@
 Сервис для работы с пользователями.
 Регистрация, активность, блокировки, реферальная система.
 """
-import time
-from typing import Optional
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
 
-from sqlalchemy import select, update
+from sqlalchemy import BigInteger, event, select, update, bindparam, literal, inspect, case
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import selectinload, raiseload, load_only
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.attributes import set_committed_value
 
+from database import commit_or_flush
 from models.user import (
     User,
     GLOBAL_ACTIVITY_DURATION,
@@ -17,12 +22,258 @@ from models.user import (
     BAN_DURATION_FIRST,
     BAN_DURATION_SECOND,
     BAN_DURATION_THIRD,
+    REFLINK_PREFIX,
+)
+from utils.send_message_utils import alert_nowait
+from utils.time_utils import now_ts
+
+
+# Повторное нажатие "Я тут" раньше, чем через час после предыдущего, в БД не пишется:
+# теряется не больше часа из 48, зато горячий путь обходится без UPDATE и COMMIT
+MIN_REFRESH_INTERVAL = 60 * 60  # 1 час
+
+# Пользователи, уже загруженные в этой сессии (tid -> User), в session.info.
+# Повторный get_by_tid того же tid в одном запросе обходится без SELECT.
+_USERS_BY_TID_KEY = "users_by_tid"
+
+# Кэш пользователей на процесс: {tid: (время, значения колонок)}.
+# Хранятся не ORM-объекты (они привязаны к своей сессии), а снимок строки —
+# из него в текущей сессии собирается persistent User без SELECT.
+#
+# Запись пользователя сбрасывает снимок дважды: сразу (mark_user_changed) и после
+# COMMIT или ROLLBACK транзакции, в которой она сделана. Пока транзакция не
+# закоммичена, другие сессии читают старую строку — второй сброс убирает снимок,
+# который они успели сохранить. Core UPDATE помечаются через mark_user_changed,
+# ORM-изменения User — автоматически при flush (_collect_user_writes).
+# Снимок, прочитанный до сброса, в кэш не попадает (_cache_version).
+USER_CACHE_TTL = 5
+USER_CACHE_MAX_SIZE = 4096
+_user_cache: Dict[int, Tuple[int, Dict[str, Any]]] = {}
+_USER_COLUMNS = tuple(attr.key for attr in User.__mapper__.column_attrs)
+
+# Версия кэша растёт при каждом сбросе; _invalidated — {tid: версия последнего сброса}.
+# Сбросы до _invalidated_floor забыты (словарь ограничен): снимки, прочитанные
+# раньше этой версии, не сохраняются вовсе.
+_cache_version = 0
+_invalidated: Dict[int, int] = {}
+_invalidated_floor = 0
+
+# tid, записанные в текущей транзакции сессии (session.info); None — все пользователи
+_USER_WRITES_KEY = "user_writes"
+
+
+def invalidate_user_cache(tid: int) -> None:
+    """Сбросить снимок пользователя из кэша процесса."""
+    global _cache_version, _invalidated_floor
+    _cache_version += 1
+    _user_cache.pop(tid, None)
+    if len(_invalidated) >= USER_CACHE_MAX_SIZE:
+        _invalidated.clear()
+        _invalidated_floor = _cache_version
+    _invalidated[tid] = _cache_version
+
+
+def clear_user_cache() -> None:
+    """Сбросить кэш пользователей целиком."""
+    global _cache_version, _invalidated_floor
+    _cache_version += 1
+    _user_cache.clear()
+    _invalidated.clear()
+    _invalidated_floor = _cache_version
+
+
+def mark_user_changed(session: AsyncSession, tid: int) -> None:
+    """
+    Отметить запись пользователя в транзакции сессии.
+    Снимок сбрасывается сейчас и ещё раз после COMMIT/ROLLBACK.
+    """
+    _mark_user_changed(session.sync_session, tid)
+
+
+def mark_all_users_changed(session: AsyncSession) -> None:
+    """Отметить массовую запись users: кэш сбрасывается целиком сейчас и после COMMIT/ROLLBACK."""
+    session.sync_session.info[_USER_WRITES_KEY] = None
+    clear_user_cache()
+
+
+def _mark_user_changed(sync_session: Session, tid: int) -> None:
+    writes = sync_session.info.setdefault(_USER_WRITES_KEY, set())
+    if writes is not None:
+        writes.add(tid)
+    invalidate_user_cache(tid)
+
+
+def _pending_user_writes(sync_session: Session) -> Optional[Set[int]]:
+    """tid с незакоммиченными записями в этой сессии (None — все)."""
+    return sync_session.info.get(_USER_WRITES_KEY, set())
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_user_writes(session, flush_context, instances) -> None:
+    """ORM-изменения User (присваивание атрибутов + commit) — тоже записи."""
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, User) and obj.tid is not None:
+            _mark_user_changed(session, obj.tid)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _flush_user_writes(session, transaction) -> None:
+    """
+    Транзакция завершена (COMMIT, ROLLBACK или закрытие сессии) —
+    сбросить снимки записанных в ней пользователей.
+    """
+    if transaction.parent is not None or _USER_WRITES_KEY not in session.info:
+        return
+    writes = session.info.pop(_USER_WRITES_KEY)
+    if writes is None:
+        clear_user_cache()
+        return
+    for tid in writes:
+        invalidate_user_cache(tid)
+
+
+# Готовые запросы (собираются один раз на модуль — сервис создаётся на каждый
+# запрос, а ключ кэша компиляции у этих statement'ов стабилен)
+# Ленивые загрузки связей запрещены, как и в TableService: если связь понадобится —
+# явно selectinload(...) перед raiseload("*") в конкретном запросе.
+_USER_LOAD_OPTIONS = (raiseload("*"),)
+
+_USER_BY_TID_QUERY = select(User).options(*_USER_LOAD_OPTIONS).where(
+    User.tid == bindparam("tid")
+)
+# Только флаги и сроки — для проверок (бан, активность), где данные профиля не нужны.
+# Остальные колонки при обращении падают сразу (raiseload), а не лениво грузятся.
+_USER_LIGHT_QUERY = select(User).options(
+    load_only(
+        User.tid,
+        User.isblocked,
+        User.ban_until,
+        User.votes,
+        User.heartbeat_until,
+        User.global_activity_until,
+        User.isref,
+        raiseload=True,
+    ),
+    *_USER_LOAD_OPTIONS,
+).where(User.tid == bindparam("tid"))
+_USERS_BY_TIDS_QUERY = select(User).options(*_USER_LOAD_OPTIONS).where(
+    User.tid.in_(bindparam("tids", expanding=True))
+)
+_USER_BY_WALLET_QUERY = select(User).options(*_USER_LOAD_OPTIONS).where(
+    User.wallet_address == bindparam("wallet_address")
+)
+
+_REFERRALS_QUERY = (
+    select(User)
+    .options(*_USER_LOAD_OPTIONS)
+    .where(User.isref == bindparam("tid"))
+    .order_by(User.regtime.desc())
+    .limit(bindparam("limit"))
+)
+
+# Регистрация одним INSERT ... ON CONFLICT (tid) DO NOTHING RETURNING.
+# Наставник подставляется подзапросом: несуществующий tid даёт NULL (без отдельного SELECT).
+# Если строку вставил параллельный /start — RETURNING пуст, пользователь уже есть.
+# ON CONFLICT есть только в диалектных insert(): вариант выбирается по движку сессии.
+def _register_query(dialect_insert):
+    """INSERT регистрации для конкретного диалекта."""
+    return (
+        dialect_insert(User)
+        .values(
+            isref=select(User.tid)
+            .where(User.tid == bindparam("referrer_tid"))
+            .scalar_subquery()
+        )
+        .on_conflict_do_nothing(index_elements=[User.tid])
+        .returning(User)
+    )
+
+
+_REGISTER_QUERIES = {
+    "postgresql": _register_query(pg_insert),
+    "sqlite": _register_query(sqlite_insert),
+}
+
+# Цепочка наставников одним рекурсивным CTE (вместо двух SELECT на каждый шаг вверх).
+# hop — расстояние от пользователя: 0 — он сам, 1 — его наставник и т.д.
+_UPLINE_CTE = (
+    select(User.tid, User.isref, literal(0).label("hop"))
+    .where(User.tid == bindparam("tid"))
+    .cte(name="upline", recursive=True)
+)
+_UPLINE_CTE = _UPLINE_CTE.union_all(
+    select(User.tid, User.isref, _UPLINE_CTE.c.hop + 1)
+    .join(_UPLINE_CTE, User.tid == _UPLINE_CTE.c.isref)
+    .where(_UPLINE_CTE.c.hop < bindparam("depth"))
+)
+_UPLINE_QUERY = (
+    select(User)
+    .options(*_USER_LOAD_OPTIONS)
+    .join(_UPLINE_CTE, User.tid == _UPLINE_CTE.c.tid)
+    .where(_UPLINE_CTE.c.hop > 0)
+    .order_by(_UPLINE_CTE.c.hop)
+)
+
+
+def _update_user(_where=None, **values):
+    """
+    UPDATE пользователя по tid с RETURNING изменённых колонок.
+    Параметры значений в identity map не вычисляются, поэтому синхронизация
+    загруженного User делается вручную по RETURNING (см. _apply_returned).
+    В UPDATE имя bindparam не должно совпадать с именем колонки из SET.
+    
+    Args:
+        _where: своё условие вместо tid = :user_tid (массовые операции)
+    """
+    return (
+        update(User)
+        .where(User.tid == bindparam("user_tid") if _where is None else _where)
+        .values(**values)
+        .returning(User.id, User.tid, *[getattr(User, column) for column in values])
+        .execution_options(synchronize_session=False)
+    )
+
+
+_REFERRAL_REGISTERED_QUERY = _update_user(
+    refscount=User.refscount + 1,
+    global_activity_until=bindparam("new_global_until"),
+)
+_HEARTBEAT_QUERY = _update_user(heartbeat_until=bindparam("new_heartbeat"))
+_GLOBAL_ACTIVITY_QUERY = _update_user(global_activity_until=bindparam("new_global_until"))
+# Бан одним атомарным UPDATE: счётчик нарушений растёт в БД, длительность
+# выбирается по новому значению (в SET votes — ещё старое значение строки)
+_BAN_QUERY = _update_user(
+    votes=User.votes + 1,
+    ban_until=bindparam("now", type_=BigInteger) + case(
+        (User.votes + 1 == 1, BAN_DURATION_FIRST),   # 72 часа
+        (User.votes + 1 == 2, BAN_DURATION_SECOND),  # 144 часа
+        else_=BAN_DURATION_THIRD,                    # 288 часов
+    ),
+)
+_CLEAR_BAN_QUERY = _update_user(ban_until=None)
+_SET_BLOCKED_QUERY = _update_user(isblocked=bindparam("blocked"))
+_WALLET_QUERY = _update_user(wallet_address=bindparam("new_wallet_address"))
+
+# Массовые операции админки: один UPDATE на список tid
+_USER_TIDS = User.tid.in_(bindparam("user_tids", expanding=True))
+_BULK_SET_BLOCKED_QUERY = _update_user(_USER_TIDS, isblocked=bindparam("blocked"))
+_BULK_CLEAR_BAN_QUERY = _update_user(_USER_TIDS, ban_until=None)
+
+# Разные значения для каждой строки — executemany (Core: ORM-синхронизация вручную)
+_BULK_WALLET_QUERY = (
+    update(User.__table__)
+    .where(User.__table__.c.tid == bindparam("user_tid"))
+    .values(wallet_address=bindparam("new_wallet_address"))
 )
-from utils.send_message_utils import alert
 
 
 class UserService:
-    """Сервис для работы с пользователями."""
+    """
+    Сервис для работы с пользователями.
+    Состояние — только сессия: экземпляр дешёвый, запросы и кэши живут на уровне модуля.
+    """
+
+    __slots__ = ("session",)
 
     def __init__(self, session: AsyncSession):
         """
@@ -45,10 +296,59 @@ class UserService:
         Returns:
             User или None если не найден
         """
-        query = select(User).where(User.tid == tid)
-        result = await self.session.execute(query)
+        now = now_ts()
+        user = self._get_cached(tid, now)
+        if user is not None:
+            return user
+        
+        version = _cache_version
+        result = await self.session.execute(_USER_BY_TID_QUERY, {"tid": tid})
+        user = result.scalar_one_or_none()
+        if user is not None:
+            self._users_by_tid()[tid] = user
+            self._remember(user, now, version)
+        return user
+
+    async def _get_user_light(self, tid: int) -> Optional[User]:
+        """
+        Пользователь для проверок: из кэша целиком, иначе только флаги и сроки.
+        Частично загруженный User в кэши не попадает; следующий get_by_tid
+        догрузит остальные колонки в тот же объект.
+        """
+        user = self._get_cached(tid, now_ts())
+        if user is not None:
+            return user
+        
+        result = await self.session.execute(_USER_LIGHT_QUERY, {"tid": tid})
         return result.scalar_one_or_none()
 
+    async def get_by_tids(self, tids: Iterable[int]) -> Dict[int, User]:
+        """
+        Получить пользователей по списку Telegram ID одним запросом.
+        Уже загруженные в этой сессии берутся без SELECT.
+        
+        Args:
+            tids: Telegram ID пользователей
+            
+        Returns:
+            Словарь {tid: User}; ненайденных tid в нём нет
+        """
+        users = {}
+        missing = []
+        for tid in dict.fromkeys(tids):
+            user = self._cached(tid)
+            if user is not None:
+                users[tid] = user
+            elif tid is not None:
+                missing.append(tid)
+        
+        if missing:
+            result = await self.session.execute(_USERS_BY_TIDS_QUERY, {"tids": missing})
+            cache = self._users_by_tid()
+            for user in result.scalars():
+                users[user.tid] = cache[user.tid] = user
+        return users
+
     async def get_by_reflink(self, reflink: str) -> Optional[User]:
         """
         Получить пользователя по реферальной ссылке.
@@ -59,9 +359,11 @@ class UserService:
         Returns:
             User или None если не найден
         """
-        query = select(User).where(User.reflink == reflink)
-        result = await self.session.execute(query)
-        return result.scalar_one_or_none()
+        # Код — это tid с префиксом: ищем по tid (уникальный индекс и кэш)
+        tid = reflink.removeprefix(REFLINK_PREFIX)
+        if tid == reflink or not tid.isdigit():
+            return None
+        return await self.get_by_tid(int(tid))
 
     async def create_user(
         self,
@@ -72,6 +374,8 @@ class UserService:
     ) -> User:
         """
         Создать нового пользователя.
+        Без refresh после commit: все значения заданы в Python, id приходит
+        из INSERT при flush, а сессии создаются с expire_on_commit=False.
         
         Args:
             tid: Telegram ID
@@ -82,34 +386,15 @@ class UserService:
         Returns:
             Созданный User
         """
-        now = int(time.time())
-        reflink = self._generate_reflink(tid)
-        
-        user = User(
-            tid=tid,
-            username=username,
-            fullname=fullname,
-            isref=referrer_tid,
-            reflink=reflink,
-            regtime=now,
-            isactive=True,
-            isadmin=False,
-            isblocked=False,
-            refscount=0,
-            votes=0,
-            # При регистрации даём 48ч на нажатие "Я тут"
-            heartbeat_until=now + HEARTBEAT_DURATION,
-            # Глобальная активность появится когда пригласит реферала
-            global_activity_until=None,
-        )
+        user = User(**self._new_user_values(tid, username, fullname), isref=referrer_tid)
         
         self.session.add(user)
         try:
-            await self.session.commit()
-            await self.session.refresh(user)
+            await commit_or_flush(self.session)
+            self._users_by_tid()[tid] = user
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при создании пользователя tid={tid}: {e}")
+            alert_nowait(f"Ошибка при создании пользователя tid={tid}: {e}")
             raise e
         
         return user
@@ -140,24 +425,35 @@ class UserService:
             await self._update_user_data(existing_user, username, fullname)
             return existing_user, False
         
-        # Валидация реферала (нельзя быть своим рефералом)
-        valid_referrer_tid = None
-        if referrer_tid and referrer_tid != tid:
-            referrer = await self.get_by_tid(referrer_tid)
-            if referrer:
-                valid_referrer_tid = referrer_tid
-        
-        # Создаём нового пользователя
-        new_user = await self.create_user(
-            tid=tid,
-            username=username,
-            fullname=fullname,
-            referrer_tid=valid_referrer_tid,
-        )
+        # Нельзя быть своим рефералом; существование наставника проверяет сам INSERT
+        if referrer_tid == tid:
+            referrer_tid = None
+        
+        try:
+            result = await self.session.execute(
+                _REGISTER_QUERIES[self.session.bind.dialect.name],
+                {**self._new_user_values(tid, username, fullname), "referrer_tid": referrer_tid},
+            )
+            new_user = result.scalar_one_or_none()
+            if new_user is None:
+                # Зарегистрирован параллельным запросом
+                return await self.get_by_tid(tid), False
+            self._users_by_tid()[tid] = new_user
+        except IntegrityError as e:
+            await self.session.rollback()
+            alert_nowait(f"Ошибка при создании пользователя tid={tid}: {e}")
+            raise e
         
-        # Обновляем наставника: +1 реферал, продление глобальной активности
-        if valid_referrer_tid:
-            await self._on_referral_registered(valid_referrer_tid)
+        # Обновляем наставника: +1 реферал, продление глобальной активности (там же commit)
+        if new_user.isref:
+            await self._on_referral_registered(new_user.isref)
+        else:
+            try:
+                await commit_or_flush(self.session)
+            except IntegrityError as e:
+                await self.session.rollback()
+                alert_nowait(f"Ошибка при создании пользователя tid={tid}: {e}")
+                raise e
         
         return new_user, True
 
@@ -168,6 +464,10 @@ class UserService:
         fullname: Optional[str],
     ) -> None:
         """Обновить данные пользователя если они изменились."""
+        # Нечего обновлять — даже не сравниваем с загруженными значениями
+        if not username and not fullname:
+            return
+        
         needs_update = False
         
         if username and user.username != username:
@@ -180,10 +480,10 @@ class UserService:
             
         if needs_update:
             try:
-                await self.session.commit()
+                await commit_or_flush(self.session)
             except IntegrityError as e:
                 await self.session.rollback()
-                await alert(f"Ошибка при обновлении пользователя tid={user.tid}: {e}")
+                alert_nowait(f"Ошибка при обновлении пользователя tid={user.tid}: {e}")
                 raise e
 
     async def _on_referral_registered(self, referrer_tid: int) -> None:
@@ -192,23 +492,19 @@ class UserService:
         - Увеличить счётчик рефералов
         - Продлить глобальную активность на 30 дней
         """
-        now = int(time.time())
+        now = now_ts()
         new_global_until = now + GLOBAL_ACTIVITY_DURATION
         
-        query = (
-            update(User)
-            .where(User.tid == referrer_tid)
-            .values(
-                refscount=User.refscount + 1,
-                global_activity_until=new_global_until,
-            )
+        result = await self.session.execute(
+            _REFERRAL_REGISTERED_QUERY,
+            {"user_tid": referrer_tid, "new_global_until": new_global_until},
         )
-        await self.session.execute(query)
+        self._apply_returned(result)
         try:
-            await self.session.commit()
+            await commit_or_flush(self.session)
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при обновлении реферера tid={referrer_tid}: {e}")
+            alert_nowait(f"Ошибка при обновлении реферера tid={referrer_tid}: {e}")
             raise e
 
     # === Реферальная система ===
@@ -221,13 +517,7 @@ class UserService:
 
     async def get_referrals(self, tid: int, limit: int = 100) -> list[User]:
         """Получить список рефералов пользователя."""
-        query = (
-            select(User)
-            .where(User.isref == tid)
-            .order_by(User.regtime.desc())
-            .limit(limit)
-        )
-        result = await self.session.execute(query)
+        result = await self.session.execute(_REFERRALS_QUERY, {"tid": tid, "limit": limit})
         return list(result.scalars().all())
 
     async def get_referrals_count(self, tid: int) -> int:
@@ -248,33 +538,25 @@ class UserService:
         Returns:
             Список наставников от ближайшего к дальнему
         """
-        upline = []
-        current_tid = tid
-        
-        for _ in range(depth):
-            user = await self.get_by_tid(current_tid)
-            if not user or not user.isref:
-                break
-            
-            referrer = await self.get_by_tid(user.isref)
-            if not referrer:
-                break
-                
-            upline.append(referrer)
-            current_tid = referrer.tid
+        # Без наставника (по данным из кэша) — цепочка пуста, запрос не нужен
+        user = self._get_cached(tid, now_ts())
+        if depth <= 0 or (user is not None and not user.isref):
+            return []
         
-        return upline
+        result = await self.session.execute(_UPLINE_QUERY, {"tid": tid, "depth": depth})
+        return list(result.scalars().all())
 
     # === Система активности ===
 
     async def press_heartbeat(self, tid: int) -> bool:
         """
         Нажатие кнопки 'Я тут' — продление на 48 часов.
+        Если с прошлого продления прошло меньше MIN_REFRESH_INTERVAL — без записи в БД.
         
         Returns:
             True если успешно, False если пользователь забанен
         """
-        user = await self.get_by_tid(tid)
+        user = await self._get_user_light(tid)
         if not user:
             return False
         
@@ -282,20 +564,25 @@ class UserService:
         if user.is_banned:
             return False
         
-        now = int(time.time())
+        now = now_ts()
         new_heartbeat = now + HEARTBEAT_DURATION
         
-        query = (
-            update(User)
-            .where(User.tid == tid)
-            .values(heartbeat_until=new_heartbeat)
+        # Недавно продлено — считаем успешным без UPDATE/COMMIT
+        if (
+            user.heartbeat_until
+            and user.heartbeat_until - now > HEARTBEAT_DURATION - MIN_REFRESH_INTERVAL
+        ):
+            return True
+        
+        result = await self.session.execute(
+            _HEARTBEAT_QUERY, {"user_tid": tid, "new_heartbeat": new_heartbeat}
         )
-        await self.session.execute(query)
+        self._apply_returned(result)
         try:
-            await self.session.commit()
+            await commit_or_flush(self.session)
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при обновлении heartbeat tid={tid}: {e}")
+            alert_nowait(f"Ошибка при обновлении heartbeat tid={tid}: {e}")
             raise e
         return True
 
@@ -304,26 +591,24 @@ class UserService:
         Продлить глобальную активность на 30 дней.
         Вызывается при регистрации реферала.
         """
-        now = int(time.time())
+        now = now_ts()
         new_global = now + GLOBAL_ACTIVITY_DURATION
         
-        query = (
-            update(User)
-            .where(User.tid == tid)
-            .values(global_activity_until=new_global)
+        result = await self.session.execute(
+            _GLOBAL_ACTIVITY_QUERY, {"user_tid": tid, "new_global_until": new_global}
         )
-        result = await self.session.execute(query)
+        updated = self._apply_returned(result)
         try:
-            await self.session.commit()
+            await commit_or_flush(self.session)
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при обновлении глобальной активности tid={tid}: {e}")
+            alert_nowait(f"Ошибка при обновлении глобальной активности tid={tid}: {e}")
             raise e
-        return result.rowcount > 0
+        return updated
 
     async def is_dormant(self, tid: int) -> bool:
         """Проверка статуса 'Спящий'."""
-        user = await self.get_by_tid(tid)
+        user = await self._get_user_light(tid)
         if not user:
             return True
         return user.is_dormant
@@ -348,44 +633,26 @@ class UserService:
         Returns:
             Количество часов блокировки
         """
-        user = await self.get_by_tid(tid)
-        if not user:
+        now = now_ts()
+        result = await self.session.execute(_BAN_QUERY, {"user_tid": tid, "now": now})
+        row = result.one_or_none()
+        if row is None:
             return 0
+        self._apply_row(row)
+        duration = row.ban_until - now
         
-        # Определяем длительность по количеству нарушений
-        new_votes = user.votes + 1
-        
-        if new_votes == 1:
-            duration = BAN_DURATION_FIRST  # 72 часа
-        elif new_votes == 2:
-            duration = BAN_DURATION_SECOND  # 144 часа
-        else:
-            duration = BAN_DURATION_THIRD  # 288 часов
-        
-        now = int(time.time())
-        ban_until = now + duration
-        
-        query = (
-            update(User)
-            .where(User.tid == tid)
-            .values(
-                votes=new_votes,
-                ban_until=ban_until,
-            )
-        )
-        await self.session.execute(query)
         try:
-            await self.session.commit()
+            await commit_or_flush(self.session)
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при применении бана tid={tid}: {e}")
+            alert_nowait(f"Ошибка при применении бана tid={tid}: {e}")
             raise e
         
         return duration // 3600  # Возвращаем часы
 
     async def check_ban(self, tid: int) -> bool:
         """Проверить активна ли блокировка."""
-        user = await self.get_by_tid(tid)
+        user = await self._get_user_light(tid)
         if not user:
             return False
         return user.is_banned
@@ -395,84 +662,257 @@ class UserService:
         Снять блокировку после оплаты 150 USDT.
         Счётчик нарушений НЕ сбрасывается!
         """
-        query = (
-            update(User)
-            .where(User.tid == tid)
-            .values(ban_until=None)
-        )
-        result = await self.session.execute(query)
+        result = await self.session.execute(_CLEAR_BAN_QUERY, {"user_tid": tid})
+        updated = self._apply_returned(result)
         try:
-            await self.session.commit()
+            await commit_or_flush(self.session)
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при снятии бана tid={tid}: {e}")
+            alert_nowait(f"Ошибка при снятии бана tid={tid}: {e}")
             raise e
-        return result.rowcount > 0
+        return updated
 
     async def permanent_ban(self, tid: int) -> bool:
         """
         Постоянная блокировка (Blacklist).
         Применяется за вред сообществу.
         """
-        query = (
-            update(User)
-            .where(User.tid == tid)
-            .values(isblocked=True)
+        result = await self.session.execute(
+            _SET_BLOCKED_QUERY, {"user_tid": tid, "blocked": True}
         )
-        result = await self.session.execute(query)
+        updated = self._apply_returned(result)
         try:
-            await self.session.commit()
+            await commit_or_flush(self.session)
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при постоянной блокировке tid={tid}: {e}")
+            alert_nowait(f"Ошибка при постоянной блокировке tid={tid}: {e}")
             raise e
-        return result.rowcount > 0
+        return updated
 
     async def remove_from_blacklist(self, tid: int) -> bool:
         """Удалить из blacklist (только admin)."""
-        query = (
-            update(User)
-            .where(User.tid == tid)
-            .values(isblocked=False)
+        result = await self.session.execute(
+            _SET_BLOCKED_QUERY, {"user_tid": tid, "blocked": False}
         )
-        result = await self.session.execute(query)
+        updated = self._apply_returned(result)
         try:
-            await self.session.commit()
+            await commit_or_flush(self.session)
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при удалении из blacklist tid={tid}: {e}")
+            alert_nowait(f"Ошибка при удалении из blacklist tid={tid}: {e}")
             raise e
-        return result.rowcount > 0
+        return updated
+
+    # === Массовые операции (админка) ===
+
+    async def bulk_set_blocked(self, tids: Iterable[int], blocked: bool) -> int:
+        """
+        Заблокировать/разблокировать многих пользователей одним UPDATE.
+        
+        Returns:
+            Количество обновлённых пользователей
+        """
+        return await self._bulk_update(
+            _BULK_SET_BLOCKED_QUERY, tids, {"blocked": blocked}, "массовой блокировке"
+        )
+
+    async def bulk_clear_ban(self, tids: Iterable[int]) -> int:
+        """
+        Снять временную блокировку с многих пользователей одним UPDATE.
+        Счётчик нарушений НЕ сбрасывается!
+        
+        Returns:
+            Количество обновлённых пользователей
+        """
+        return await self._bulk_update(_BULK_CLEAR_BAN_QUERY, tids, {}, "массовом снятии бана")
+
+    async def _bulk_update(self, query, tids: Iterable[int], params: dict, action: str) -> int:
+        """Выполнить массовый UPDATE по списку tid и закоммитить."""
+        tids = list(tids)
+        if not tids:
+            return 0
+        
+        try:
+            result = await self.session.execute(query, {"user_tids": tids, **params})
+            rows = result.all()
+            for row in rows:
+                self._apply_row(row)
+            await commit_or_flush(self.session)
+        except IntegrityError as e:
+            await self.session.rollback()
+            alert_nowait(f"Ошибка при {action} ({len(tids)} шт.): {e}")
+            raise e
+        return len(rows)
 
     # === Кошелёк ===
 
     async def update_wallet(self, tid: int, wallet_address: str) -> bool:
         """Привязать TON кошелёк к пользователю."""
-        query = (
-            update(User)
-            .where(User.tid == tid)
-            .values(wallet_address=wallet_address)
+        result = await self.session.execute(
+            _WALLET_QUERY, {"user_tid": tid, "new_wallet_address": wallet_address}
         )
-        result = await self.session.execute(query)
+        updated = self._apply_returned(result)
+        try:
+            await commit_or_flush(self.session)
+        except IntegrityError as e:
+            await self.session.rollback()
+            alert_nowait(f"Ошибка при обновлении кошелька tid={tid}: {e}")
+            raise e
+        return updated
+
+    async def bulk_update_wallet(self, pairs: Iterable[Tuple[int, str]]) -> None:
+        """
+        Привязать кошельки многим пользователям одной транзакцией (executemany).
+        
+        Args:
+            pairs: пары (tid, адрес кошелька)
+        """
+        params = [
+            {"user_tid": tid, "new_wallet_address": wallet_address}
+            for tid, wallet_address in pairs
+        ]
+        if not params:
+            return
+        
         try:
-            await self.session.commit()
+            await self.session.execute(_BULK_WALLET_QUERY, params)
+            for item in params:
+                mark_user_changed(self.session, item["user_tid"])
+            await commit_or_flush(self.session)
         except IntegrityError as e:
             await self.session.rollback()
-            await alert(f"Ошибка при обновлении кошелька tid={tid}: {e}")
+            alert_nowait(f"Ошибка при массовом обновлении кошельков ({len(params)} шт.): {e}")
             raise e
-        return result.rowcount > 0
+        
+        for item in params:
+            user = self._cached(item["user_tid"])
+            if user is not None:
+                set_committed_value(user, "wallet_address", item["new_wallet_address"])
 
     async def get_by_wallet(self, wallet_address: str) -> Optional[User]:
         """Найти пользователя по адресу кошелька."""
-        query = select(User).where(User.wallet_address == wallet_address)
-        result = await self.session.execute(query)
+        result = await self.session.execute(
+            _USER_BY_WALLET_QUERY, {"wallet_address": wallet_address}
+        )
         return result.scalar_one_or_none()
 
     # === Утилиты ===
 
-    def _generate_reflink(self, tid: int) -> str:
-        """Генерация уникального реферального кода."""
-        return f"dp_{tid}"
+    def _get_cached(self, tid: int, now: int) -> Optional[User]:
+        """Пользователь из кэша сессии или из снимка кэша процесса (без SELECT)."""
+        user = self._cached(tid)
+        if user is not None:
+            return user
+        
+        cached = _user_cache.get(tid)
+        if cached is not None and now - cached[0] < USER_CACHE_TTL:
+            user = self._from_snapshot(cached[1])
+            self._users_by_tid()[tid] = user
+            return user
+        return None
+
+    def _from_snapshot(self, values: Dict[str, Any]) -> User:
+        """
+        User из снимка кэша, привязанный к текущей сессии без SELECT.
+        Если этот пользователь уже есть в identity map — берём его.
+        """
+        user = self.session.identity_map.get(identity_key(User, values["id"]))
+        if user is not None:
+            # Мог быть загружен частично (_get_user_light) — дополняем из снимка
+            for key in inspect(user).unloaded:
+                set_committed_value(user, key, values[key])
+            return user
+        user = User.__mapper__.class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        self.session.add(user)
+        return user
+
+    def _remember(self, user: User, now: int, version: int) -> None:
+        """
+        Сохранить снимок пользователя в кэш процесса.
+        
+        Args:
+            version: _cache_version на момент перед SELECT
+        """
+        # После SELECT пользователя сбросили — прочитанная строка могла устареть
+        if version < _invalidated_floor or _invalidated.get(user.tid, 0) > version:
+            return
+        # Незакоммиченные данные этой сессии в общий кэш не попадают
+        writes = _pending_user_writes(self.session.sync_session)
+        if writes is None or user.tid in writes:
+            return
+        if len(_user_cache) >= USER_CACHE_MAX_SIZE:
+            for stale_tid in [k for k, v in _user_cache.items() if now - v[0] >= USER_CACHE_TTL]:
+                _user_cache.pop(stale_tid, None)
+            if len(_user_cache) >= USER_CACHE_MAX_SIZE:
+                _user_cache.clear()
+        _user_cache[user.tid] = (now, {key: getattr(user, key) for key in _USER_COLUMNS})
+
+    def _users_by_tid(self) -> Dict[int, User]:
+        """Кэш пользователей этой сессии (tid -> User)."""
+        return self.session.info.setdefault(_USERS_BY_TID_KEY, {})
+
+    def _cached(self, tid: int) -> Optional[User]:
+        """
+        Пользователь из кэша сессии, если он ещё актуален.
+        После rollback объекты истекают (или отсоединяются) — такие выбрасываем.
+        """
+        cache = self._users_by_tid()
+        user = cache.get(tid)
+        if user is None:
+            return None
+        state = inspect(user)
+        if not state.persistent or state.expired_attributes:
+            del cache[tid]
+            return None
+        return user
+
+    def _apply_returned(self, result) -> bool:
+        """
+        Перенести значения из RETURNING в загруженные экземпляры User (если они в сессии).
+        
+        Returns:
+            True если обновлена хотя бы одна строка
+        """
+        updated = False
+        for row in result:
+            updated = True
+            self._apply_row(row)
+        return updated
+
+    def _apply_row(self, row) -> None:
+        """Перенести одну строку RETURNING в загруженный экземпляр User."""
+        mark_user_changed(self.session, row.tid)
+        obj = self.session.identity_map.get(identity_key(User, row.id))
+        if obj is not None:
+            for key, value in row._mapping.items():
+                set_committed_value(obj, key, value)
+
+    @staticmethod
+    def _new_user_values(
+        tid: int,
+        username: Optional[str],
+        fullname: Optional[str],
+    ) -> Dict[str, Any]:
+        """Значения колонок нового пользователя (без наставника)."""
+        now = now_ts()
+        return {
+            "tid": tid,
+            "username": username,
+            "fullname": fullname,
+            "regtime": now,
+            "isactive": True,
+            "isadmin": False,
+            "isblocked": False,
+            "refscount": 0,
+            "votes": 0,
+            # При регистрации даём 48ч на нажатие "Я тут"
+            "heartbeat_until": now + HEARTBEAT_DURATION,
+            # Глобальная активность появится когда пригласит реферала
+            "global_activity_until": None,
+        }
 
 
 # Вспомогательная функция
@@ -0,0 +1,18 @@
+"""
+Общая настройка тестов: SQLite в памяти вместо PostgreSQL.
+Переменные окружения выставляются до импорта config/database —
+движок создаётся при импорте модуля.
+"""
+import os
+
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+os.environ.setdefault("BOT_TOKEN", "123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi")
+
+from sqlalchemy import BigInteger
+from sqlalchemy.ext.compiler import compiles
+
+
+@compiles(BigInteger, "sqlite")
+def _compile_big_integer_sqlite(type_, compiler, **kw):
+    # users.tid — rowid, как в smoke-прогонах
+    return "INTEGER"
@@ -0,0 +1,98 @@
+"""
+Кэш пользователей на процесс: снимок не должен пережить запись другой сессии.
+Нужны настоящие параллельные транзакции, поэтому база — файл SQLite
+(в памяти все сессии делят одно соединение и видят незакоммиченное).
+"""
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from database import Base, unit_of_work
+from services.table_service import TableService
+from services.user_service import UserService, clear_user_cache
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'cache.db'}")
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with AsyncSession(engine) as session:
+            await UserService(session).register_or_get(7, "u7", "User 7")
+
+    asyncio.run(setup())
+    clear_user_cache()
+    yield async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    clear_user_cache()
+    asyncio.run(engine.dispose())
+
+
+def test_read_during_uncommitted_ban_is_not_cached(session_factory):
+    async def scenario():
+        async with session_factory() as writer, session_factory() as reader:
+            async with unit_of_work(writer):
+                await UserService(writer).permanent_ban(7)
+                # Транзакция бана ещё не закоммичена — читатель видит старую строку
+                stale = await UserService(reader).get_by_tid(7)
+                assert stale.isblocked is False
+        async with session_factory() as session:
+            return await TableService(session).can_user_join(7, 1)
+
+    assert asyncio.run(scenario()) == (False, "USER_BLOCKED")
+
+
+def test_read_finished_after_ban_commit_is_not_cached(session_factory):
+    async def scenario():
+        async with session_factory() as writer, session_factory() as reader:
+            # SELECT читателя выполнен до бана, а результат обработан после COMMIT
+            selected, resume = asyncio.Event(), asyncio.Event()
+            execute = reader.execute
+
+            async def delayed_execute(*args, **kwargs):
+                result = await execute(*args, **kwargs)
+                selected.set()
+                await resume.wait()
+                return result
+
+            reader.execute = delayed_execute
+            read = asyncio.create_task(UserService(reader).get_by_tid(7))
+            await selected.wait()
+            await UserService(writer).permanent_ban(7)
+            resume.set()
+            assert (await read).isblocked is False
+        async with session_factory() as session:
+            return await TableService(session).can_user_join(7, 1)
+
+    assert asyncio.run(scenario()) == (False, "USER_BLOCKED")
+
+
+def test_rolled_back_write_is_not_cached(session_factory):
+    async def scenario():
+        async with session_factory() as writer:
+            with pytest.raises(RuntimeError):
+                async with unit_of_work(writer):
+                    await UserService(writer).permanent_ban(7)
+                    # Незакоммиченный бан в общий кэш не попадает
+                    await UserService(writer).get_by_tid(7)
+                    raise RuntimeError
+        async with session_factory() as session:
+            return await TableService(session).can_user_join(7, 1)
+
+    assert asyncio.run(scenario()) == (True, "OK")
+
+
+def test_orm_write_invalidates_snapshot(session_factory):
+    async def scenario():
+        async with session_factory() as session:
+            await UserService(session).get_by_tid(7)  # снимок в кэше процесса
+        async with session_factory() as session:
+            user = await UserService(session).get_by_tid(7)
+            user.isadmin = True
+            await session.commit()
+        async with session_factory() as session:
+            return (await UserService(session).get_by_tid(7)).isadmin
+
+    assert asyncio.run(scenario()) is True
@@ -0,0 +1,80 @@
+"""
+Число SQL-запросов горячих путей UserService (защита от N+1).
+Запускается на SQLite в памяти (см. conftest.py).
+"""
+import asyncio
+
+import pytest
+
+from database import AsyncSessionLocal, Base, engine
+from services.user_service import UserService, clear_user_cache
+from utils.db_profiling import count_queries
+
+
+async def _reset_schema() -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    clear_user_cache()
+
+
+async def _register_chain(length: int) -> None:
+    """Цепочка 1 ← 2 ← ... ← length (у каждого наставник — предыдущий)."""
+    async with AsyncSessionLocal() as session:
+        user_service = UserService(session)
+        for tid in range(1, length + 1):
+            await user_service.register_or_get(
+                tid, f"u{tid}", f"User {tid}", referrer_tid=tid - 1 if tid > 1 else None
+            )
+    clear_user_cache()
+
+
+@pytest.fixture(autouse=True)
+def fresh_db():
+    asyncio.run(_reset_schema())
+    yield
+    clear_user_cache()
+
+
+def test_upline_is_one_query():
+    async def scenario():
+        await _register_chain(55)
+        async with AsyncSessionLocal() as session:
+            async with count_queries(session) as queries:
+                upline = await UserService(session).get_upline(55, depth=50)
+        return upline, queries
+
+    upline, queries = asyncio.run(scenario())
+    assert [user.tid for user in upline] == list(range(54, 4, -1))
+    assert len(queries) == 1
+
+
+def test_register_with_referrer_queries():
+    async def scenario():
+        await _register_chain(1)
+        async with AsyncSessionLocal() as session:
+            async with count_queries(session) as queries:
+                user, is_new = await UserService(session).register_or_get(
+                    2, "u2", "User 2", referrer_tid=1
+                )
+        return user, is_new, queries
+
+    user, is_new, queries = asyncio.run(scenario())
+    assert is_new and user.isref == 1
+    # SELECT существующего, INSERT нового, UPDATE наставника
+    assert [q.lstrip().split()[0].upper() for q in queries] == ["SELECT", "INSERT", "UPDATE"]
+
+
+def test_apply_ban_is_one_update():
+    async def scenario():
+        await _register_chain(1)
+        async with AsyncSessionLocal() as session:
+            async with count_queries(session) as queries:
+                hours = await UserService(session).apply_ban(1)
+        return hours, queries
+
+    hours, queries = asyncio.run(scenario())
+    assert hours > 0
+    assert len(queries) == 1
+    assert queries[0].lstrip().upper().startswith("UPDATE")
+    assert "RETURNING" in queries[0].upper()
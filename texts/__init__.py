@@ -1,26 +1,54 @@
 """
 Тексты сообщений бота.
+Символы импортируются лениво (PEP 562): `from texts.messages import ...`
+не тянет за собой board_messages и модели.
 """
-from .messages import (
-    get_welcome_message,
-    get_welcome_back_message,
-    get_blocked_message,
-    get_dormant_warning_message,
-    get_ban_message,
-    get_wallet_connected_message,
-    get_referral_registered_message,
-    get_gift_received_message,
-    get_gift_sent_message,
-    get_not_registered_message,
-)
-from .board_messages import (
-    get_levels_message,
-    get_no_boards_message,
-    get_boards_list_message,
-    get_board_detail_message,
-    get_join_success_message,
-    get_join_error_message,
-)
+import importlib
+
+# Имя функции -> модуль, где она определена
+_LAZY = {
+    **dict.fromkeys(
+        (
+            "get_welcome_message",
+            "get_welcome_back_message",
+            "get_blocked_message",
+            "get_dormant_warning_message",
+            "get_ban_message",
+            "get_wallet_connected_message",
+            "get_referral_registered_message",
+            "get_gift_received_message",
+            "get_gift_sent_message",
+            "get_not_registered_message",
+        ),
+        ".messages",
+    ),
+    **dict.fromkeys(
+        (
+            "get_levels_message",
+            "get_no_boards_message",
+            "get_boards_list_message",
+            "get_board_detail_message",
+            "get_join_success_message",
+            "get_join_error_message",
+        ),
+        ".board_messages",
+    ),
+}
+
+
+def __getattr__(name: str):
+    """Импорт символа при первом обращении (дальше берётся из globals)."""
+    module_name = _LAZY.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
+
 
 __all__ = [
     # User messages
@@ -1,21 +1,55 @@
 """
 Тексты сообщений о досках.
 """
-from typing import List, Optional
-from models.table import Table, LEVELS, TableStatus
+from typing import List, Optional, Tuple
+from models.table import Table, LEVELS, TableStatus, LEFT_DONORS_MASK, RIGHT_DONORS_MASK
+from utils.time_utils import now_ts
+
+
+# Неизменный скелет схемы доски (собирается один раз при импорте)
+_BOARD_TEMPLATE = "\n".join([
+    "┌─────── Структура ───────┐",
+    "│       {rec} REC            │",
+    "│      /     \\           │",
+    "│   {crl}CR     CR{crr}       │",
+    "│   / \\     / \\          │",
+    "│ {stl1}ST ST{stl2} {str3}ST ST{str4}   │",
+    "│{dl1}{dl2}{dl3}{dl4}       {dr5}{dr6}{dr7}{dr8}│",
+    "└─────────────────────────┘",
+    "",
+    "⚫ пусто  🟡 ждёт оплаты  ✅ оплачено",
+    "",
+])
+
+# Позиции схемы: занятые и дарители (у дарителей — ещё и отметка оплаты)
+_BOARD_SEATS = ('rec', 'crl', 'crr', 'stl1', 'stl2', 'str3', 'str4')
+_BOARD_DONORS = ('dl1', 'dl2', 'dl3', 'dl4', 'dr5', 'dr6', 'dr7', 'dr8')
+
+
+# Уровни статичны: (эмодзи, название, сумма) считаются один раз при импорте
+_LEVEL_CACHE = {
+    level: ("💎" if level >= 10 else "🔹" if level >= 5 else "▫️", info["name"], info["amount"])
+    for level, info in LEVELS.items()
+}
+
+_LEVELS_MESSAGE = "\n".join([
+    "🎯 <b>Уровни досок</b>\n",
+    *[f"{emoji} <b>{name}</b> — {amount} USDT" for emoji, name, amount in _LEVEL_CACHE.values()],
+    "\n💡 Выберите уровень для входа:",
+])
+
+
+def _level_info(level: int) -> Tuple[str, int]:
+    """Название и сумма уровня (для неизвестного уровня — L{n} и 0)."""
+    cached = _LEVEL_CACHE.get(level)
+    if cached is None:
+        return f"L{level}", 0
+    return cached[1], cached[2]
 
 
 def get_levels_message() -> str:
     """Сообщение со списком уровней."""
-    lines = ["🎯 <b>Уровни досок</b>\n"]
-    
-    for level, info in LEVELS.items():
-        emoji = "💎" if level >= 10 else "🔹" if level >= 5 else "▫️"
-        lines.append(f"{emoji} <b>{info['name']}</b> — {info['amount']} USDT")
-    
-    lines.append("\n💡 Выберите уровень для входа:")
-    
-    return "\n".join(lines)
+    return _LEVELS_MESSAGE
 
 
 def get_no_boards_message() -> str:
@@ -41,14 +75,13 @@ async def get_boards_list_message(
     """Сообщение со списком досок пользователя."""
     lines = [f"📊 <b>Мои доски ({len(tables)})</b>\n"]
     
+    # Позиции на всех досках — одним вызовом до цикла
+    positions = table_service.get_user_positions_bulk(tables, user_tid)
+    
     for table in tables:
-        level_info = LEVELS.get(table.level, {})
-        level_name = level_info.get("name", f"L{table.level}")
-        amount = level_info.get("amount", 0)
+        level_name, amount = _level_info(table.level)
         
-        # Определяем позицию пользователя
-        position = await table_service.get_user_position(table, user_tid)
-        position_name = await table_service.get_position_name(position) if position else "?"
+        position_name = positions[table.id][1] or "?"
         
         # Статус
         if table.status == TableStatus.CLOSED.value:
@@ -75,13 +108,11 @@ async def get_board_detail_message(
     user_tid: int,
 ) -> str:
     """Детальное сообщение о доске."""
-    level_info = LEVELS.get(table.level, {})
-    level_name = level_info.get("name", f"L{table.level}")
-    amount = level_info.get("amount", 0)
+    level_name, amount = _level_info(table.level)
     
     # Позиция пользователя
-    position = await table_service.get_user_position(table, user_tid)
-    position_name = await table_service.get_position_name(position) if position else "Не на доске"
+    position = table_service.get_user_position(table, user_tid)
+    position_name = table_service.get_position_name(position) if position else "Не на доске"
     
     # Статус доски
     if table.status == TableStatus.CLOSED.value:
@@ -93,6 +124,12 @@ async def get_board_detail_message(
     else:
         status = "⏳ Ожидание"
     
+    # Визуализация доски (скелет готов, подставляем только отметки позиций)
+    pay_mask = table.pay_mask
+    marks = {slot: '🟢' if getattr(table, slot) else '⚫' for slot in _BOARD_SEATS}
+    for bit, slot in enumerate(_BOARD_DONORS):
+        marks[slot] = "✅" if pay_mask >> bit & 1 else ("🟡" if getattr(table, slot) else "⚫")
+    
     lines = [
         f"📊 <b>Доска #{table.id}</b>\n",
         f"🎯 Уровень: <b>{level_name}</b> ({amount} USDT)",
@@ -100,35 +137,12 @@ async def get_board_detail_message(
         f"📈 Статус: {status}",
         f"🎁 Подарков: <b>{table.gifts_received}/8</b>",
         "",
+        _BOARD_TEMPLATE.format_map(marks),
     ]
     
-    # Визуализация доски
-    lines.append("┌─────── Структура ───────┐")
-    lines.append(f"│       {'🟢' if table.rec else '⚫'} REC            │")
-    lines.append(f"│      /     \\           │")
-    lines.append(f"│   {'🟢' if table.crl else '⚫'}CR     CR{'🟢' if table.crr else '⚫'}       │")
-    lines.append(f"│   / \\     / \\          │")
-    lines.append(f"│ {'🟢' if table.stl1 else '⚫'}ST ST{'🟢' if table.stl2 else '⚫'} {'🟢' if table.str3 else '⚫'}ST ST{'🟢' if table.str4 else '⚫'}   │")
-    
-    # Дарители с оплатой
-    d1 = "✅" if table.dl1_pay else ("🟡" if table.dl1 else "⚫")
-    d2 = "✅" if table.dl2_pay else ("🟡" if table.dl2 else "⚫")
-    d3 = "✅" if table.dl3_pay else ("🟡" if table.dl3 else "⚫")
-    d4 = "✅" if table.dl4_pay else ("🟡" if table.dl4 else "⚫")
-    d5 = "✅" if table.dr5_pay else ("🟡" if table.dr5 else "⚫")
-    d6 = "✅" if table.dr6_pay else ("🟡" if table.dr6 else "⚫")
-    d7 = "✅" if table.dr7_pay else ("🟡" if table.dr7 else "⚫")
-    d8 = "✅" if table.dr8_pay else ("🟡" if table.dr8 else "⚫")
-    
-    lines.append(f"│{d1}{d2}{d3}{d4}       {d5}{d6}{d7}{d8}│")
-    lines.append("└─────────────────────────┘")
-    lines.append("")
-    lines.append("⚫ пусто  🟡 ждёт оплаты  ✅ оплачено")
-    
     # Информация о сторонах
-    lines.append("")
-    left_paid = sum([table.dl1_pay, table.dl2_pay, table.dl3_pay, table.dl4_pay])
-    right_paid = sum([table.dr5_pay, table.dr6_pay, table.dr7_pay, table.dr8_pay])
+    left_paid = (pay_mask & LEFT_DONORS_MASK).bit_count()
+    right_paid = (pay_mask & RIGHT_DONORS_MASK).bit_count()
     
     lines.append(f"◀️ Левая: {left_paid}/4 {'✂️ готово!' if table.can_split_left else ''}")
     lines.append(f"▶️ Правая: {right_paid}/4 {'✂️ готово!' if table.can_split_right else ''}")
@@ -139,8 +153,7 @@ async def get_board_detail_message(
         is_paid = getattr(table, f"{position}_pay", False)
         
         if deadline and not is_paid:
-            import time
-            remaining = deadline - int(time.time())
+            remaining = deadline - now_ts()
             hours = remaining // 3600
             
             if hours > 0:
@@ -157,9 +170,7 @@ def get_join_success_message(
     position_name: str,
 ) -> str:
     """Сообщение об успешном входе на доску."""
-    level_info = LEVELS.get(table.level, {})
-    level_name = level_info.get("name", f"L{table.level}")
-    amount = level_info.get("amount", 0)
+    level_name, amount = _level_info(table.level)
     
     return f"""✅ <b>Вы вошли на доску!</b>
 
@@ -175,8 +186,7 @@ def get_join_success_message(
 
 def get_join_error_message(reason: str, level: int) -> str:
     """Сообщение об ошибке входа."""
-    level_info = LEVELS.get(level, {})
-    level_name = level_info.get("name", f"L{level}")
+    level_name, _ = _level_info(level)
     
     messages = {
         "USER_ALREADY_ON_LEVEL": (
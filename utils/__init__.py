@@ -2,7 +2,7 @@
 Вспомогательные утилиты.
 Вспомогательные функции для работы с данными, форматирования и т.д.
 """
-from .send_message_utils import alert
+from .send_message_utils import alert, alert_nowait
 
-__all__ = ["alert"]
+__all__ = ["alert", "alert_nowait"]
 
@@ -0,0 +1,39 @@
+"""
+Профилирование запросов к БД.
+Счётчик SQL-запросов для поиска N+1 при рефакторинге сервисов.
+"""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+@asynccontextmanager
+async def count_queries(session: AsyncSession) -> AsyncIterator[List[str]]:
+    """
+    Собрать SQL всех запросов, выполненных внутри блока.
+
+    Слушатель вешается на движок сессии, а не на соединение: после commit
+    сессия может взять из пула другое соединение. Поэтому запросы других
+    сессий этого движка, выполненные в то же время, тоже попадут в список.
+
+    Пример:
+        async with count_queries(session) as queries:
+            await user_service.get_upline(tid, depth=50)
+        assert len(queries) <= 1
+
+    Yields:
+        Список текстов SQL (пополняется по ходу выполнения)
+    """
+    statements: List[str] = []
+    sync_engine = session.sync_session.get_bind()
+
+    def _on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(sync_engine, "before_cursor_execute", _on_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", _on_execute)
@@ -1,30 +1,117 @@
 """
 Утилиты для отправки сообщений.
 Функция alert() для логирования ошибок в чат логов.
+
+Сообщения не отправляются сразу, а кладутся в очередь: один фоновый
+обработчик склеивает идущие подряд сообщения и отправляет их пачкой,
+чтобы шторм ошибок не превращался в шторм запросов к Telegram.
 """
+import asyncio
 import logging
+from typing import List, Optional
 
 from bot_instance import bot
 from config import LOGCHAT
 
 logger = logging.getLogger(__name__)
 
+ALERT_QUEUE_MAX_SIZE = 10_000
+ALERT_BATCH_WINDOW = 0.5  # секунд на сбор пачки после первого сообщения
+ALERT_BATCH_MAX_SIZE = 20  # сообщений в пачке
+ALERT_MAX_LENGTH = 4096  # лимит длины сообщения Telegram
+ALERT_SEPARATOR = "\n---\n"
+
+_alert_queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=ALERT_QUEUE_MAX_SIZE)
+_alert_worker_task: Optional[asyncio.Task] = None
+
 
 async def alert(text: str) -> None:
     """
     Отправить сообщение в чат логов.
-    
+
     Используется для логирования ошибок и важных событий.
-    Если LOGCHAT не настроен, сообщение выводится в консоль.
-    
+    Сообщение ставится в очередь и уходит в фоне (см. alert_nowait).
+
     Args:
         text: Текст сообщения для отправки
     """
+    alert_nowait(text)
+
+
+def alert_nowait(text: str) -> None:
+    """
+    Поставить сообщение для чата логов в очередь, не дожидаясь сети.
+
+    Если LOGCHAT не настроен, сообщение выводится в консоль.
+    Если очередь переполнена — сообщение уходит только в лог.
+    """
+    if not LOGCHAT:
+        logger.warning(f"LOGCHAT не настроен. Сообщение: {text}")
+        return
+    try:
+        _alert_queue.put_nowait(text)
+    except asyncio.QueueFull:
+        logger.error(f"Очередь alert переполнена. Текст сообщения: {text}")
+        return
+    start_alert_worker()
+
+
+def start_alert_worker() -> None:
+    """Запустить фоновый обработчик очереди (если ещё не запущен)."""
+    global _alert_worker_task
+    if _alert_worker_task is None or _alert_worker_task.done():
+        _alert_worker_task = asyncio.create_task(_alert_worker())
+
+
+async def stop_alert_worker(timeout: float = 5.0) -> None:
+    """Дождаться отправки очереди (не дольше timeout) и остановить обработчик."""
+    global _alert_worker_task
+    if _alert_worker_task is None:
+        return
     try:
-        if LOGCHAT:
-            await bot.send_message(chat_id=LOGCHAT, text=text)
-        else:
-            logger.warning(f"LOGCHAT не настроен. Сообщение: {text}")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке сообщения в LOGCHAT: {e}")
-        logger.error(f"Текст сообщения: {text}")
+        await asyncio.wait_for(_alert_queue.join(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Не отправлено сообщений в LOGCHAT: {_alert_queue.qsize()}")
+    _alert_worker_task.cancel()
+    _alert_worker_task = None
+
+
+def _pack(batch: List[str]) -> List[str]:
+    """Склеить пачку в сообщения не длиннее ALERT_MAX_LENGTH."""
+    messages = []
+    current = ""
+    for text in batch:
+        text = text[:ALERT_MAX_LENGTH]
+        if current and len(current) + len(ALERT_SEPARATOR) + len(text) > ALERT_MAX_LENGTH:
+            messages.append(current)
+            current = ""
+        current = f"{current}{ALERT_SEPARATOR}{text}" if current else text
+    if current:
+        messages.append(current)
+    return messages
+
+
+async def _alert_worker() -> None:
+    """Фоновый обработчик: собирает пачку за ALERT_BATCH_WINDOW и отправляет."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _alert_queue.get()]
+        deadline = loop.time() + ALERT_BATCH_WINDOW
+        while len(batch) < ALERT_BATCH_MAX_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_alert_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            for text in _pack(batch):
+                await bot.send_message(chat_id=LOGCHAT, text=text)
+        except Exception as e:
+            logger.error(f"Ошибка при отправке сообщения в LOGCHAT: {e}")
+            logger.error(f"Текст сообщения: {ALERT_SEPARATOR.join(batch)}")
+        finally:
+            for _ in batch:
+                _alert_queue.task_done()
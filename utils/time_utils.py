@@ -0,0 +1,34 @@
+"""
+Утилиты времени.
+Единые "часы" на обработку одного апдейта: время фиксируется один раз
+в middleware, а свойства моделей читают его вместо повторных time.time().
+"""
+import time
+from contextvars import ContextVar, Token
+from typing import Optional
+
+# Время (Unix timestamp), зафиксированное на текущий апдейт
+_NOW: ContextVar[Optional[int]] = ContextVar("now", default=None)
+
+
+def now_ts() -> int:
+    """
+    Текущее время (Unix timestamp).
+
+    Внутри обработки апдейта возвращает зафиксированное значение,
+    вне его — системное время.
+    """
+    now = _NOW.get()
+    if now is None:
+        return time.time_ns() // 1_000_000_000
+    return now
+
+
+def freeze_now() -> Token:
+    """Зафиксировать текущее время для контекста (начало обработки апдейта)."""
+    return _NOW.set(time.time_ns() // 1_000_000_000)
+
+
+def unfreeze_now(token: Token) -> None:
+    """Снять фиксацию времени (конец обработки апдейта)."""
+    _NOW.reset(token)